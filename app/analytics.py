@@ -0,0 +1,132 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+
+from app.config import settings
+from app.models import (
+    ShortURL,
+    URLAnalyticsResponse,
+    URLCountryStats,
+    URLDailyStats,
+    URLHourlyStats,
+    URLRefererStats,
+)
+from app.redis_client import redis_service
+from app.utils import get_unique_visitors_key
+from app.visit_buffer import VisitEvent
+
+# visits carry no country until a geo lookup exists, so they all roll up here
+UNKNOWN_COUNTRY = "unknown"
+DIRECT_REFERER = "(direct)"
+
+
+def upsert_increment(session: Session, model, rows: List[dict], keys: List[str]):
+    """Insert counter rows, adding `visits` onto rows that already exist"""
+    if not rows:
+        return
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    table = model.__table__
+    statement = dialect.insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={"visits": table.c.visits + statement.excluded.visits},
+    )
+    session.execute(statement, rows)
+
+
+class AnalyticsService:
+    """Maintains per url rollups as visits are flushed and serves analytics from them"""
+
+    def record_visits(self, session: Session, events: List[VisitEvent]):
+        """Add a batch of visits to the rollup tables, committed by the caller"""
+        daily = Counter()
+        hourly = Counter()
+        countries = Counter()
+        referers = Counter()
+        for event in events:
+            visited_at = event.visited_at.astimezone(timezone.utc)
+            daily[(event.url_id, visited_at.date())] += 1
+            hourly[(event.url_id, visited_at.replace(minute=0, second=0, microsecond=0))] += 1
+            countries[(event.url_id, UNKNOWN_COUNTRY)] += 1
+            referers[(event.url_id, event.referer or DIRECT_REFERER)] += 1
+
+        upsert_increment(
+            session,
+            URLDailyStats,
+            [{"url_id": u, "day": d, "visits": n} for (u, d), n in daily.items()],
+            ["url_id", "day"],
+        )
+        upsert_increment(
+            session,
+            URLHourlyStats,
+            [{"url_id": u, "hour": h, "visits": n} for (u, h), n in hourly.items()],
+            ["url_id", "hour"],
+        )
+        upsert_increment(
+            session,
+            URLCountryStats,
+            [{"url_id": u, "country": c, "visits": n} for (u, c), n in countries.items()],
+            ["url_id", "country"],
+        )
+        upsert_increment(
+            session,
+            URLRefererStats,
+            [{"url_id": u, "referer": r, "visits": n} for (u, r), n in referers.items()],
+            ["url_id", "referer"],
+        )
+
+    def record_unique_visitors(self, events: List[VisitEvent]):
+        visitors = defaultdict(set)
+        for event in events:
+            if event.ip_address:
+                visitors[get_unique_visitors_key(event.url_id)].add(event.ip_address)
+        if visitors:
+            redis_service.add_to_hyperloglogs(visitors)
+
+    def get_url_analytics(self, session: Session, url: ShortURL) -> URLAnalyticsResponse:
+        now = datetime.now(timezone.utc)
+        since_day = (now - timedelta(days=settings.analytics_days - 1)).date()
+        since_hour = (now - timedelta(hours=settings.analytics_hours - 1)).replace(
+            minute=0, second=0, microsecond=0
+        )
+
+        daily = session.exec(
+            select(URLDailyStats.day, URLDailyStats.visits)
+            .where(URLDailyStats.url_id == url.id, URLDailyStats.day >= since_day)
+            .order_by(URLDailyStats.day)
+        ).all()
+        hourly = session.exec(
+            select(URLHourlyStats.hour, URLHourlyStats.visits)
+            .where(URLHourlyStats.url_id == url.id, URLHourlyStats.hour >= since_hour)
+            .order_by(URLHourlyStats.hour)
+        ).all()
+        countries = session.exec(
+            select(URLCountryStats.country, URLCountryStats.visits).where(
+                URLCountryStats.url_id == url.id
+            )
+        ).all()
+        referers = session.exec(
+            select(URLRefererStats.referer, URLRefererStats.visits)
+            .where(URLRefererStats.url_id == url.id)
+            .order_by(URLRefererStats.visits.desc())
+            .limit(settings.analytics_top_referers)
+        ).all()
+
+        return URLAnalyticsResponse(
+            total_visits=url.visit_count,
+            unique_visitors=redis_service.count_hyperloglog(
+                get_unique_visitors_key(url.id)
+            ),
+            visits_by_country={country: visits for country, visits in countries},
+            visits_by_date={day.isoformat(): visits for day, visits in daily},
+            visits_by_hour={hour.isoformat(): visits for hour, visits in hourly},
+            top_referers=[
+                {"referer": referer, "visits": visits} for referer, visits in referers
+            ],
+        )
+
+
+analytics_service = AnalyticsService()
@@ -0,0 +1,165 @@
+"""Streams raw click analytics into Parquet or Arrow IPC files.
+
+Rows are read from the partition cursor in fixed size record batches and
+written out as they arrive, so memory stays flat whatever the export size.
+Requires the optional pyarrow dependency.
+
+    python -m app.analytics_export --url-id 1 --format parquet --output clicks.parquet
+"""
+
+import argparse
+import io
+from datetime import datetime
+from typing import Iterator, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from app.analytics_partitions import analytics_partitions
+from app.config import settings
+from app.database import read_engine
+
+EXPORT_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def export_schema():
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("url_id", pa.int64()),
+            ("user_id", pa.int64()),
+            ("visited_at", pa.timestamp("us", tz="UTC")),
+            ("ip_address", pa.string()),
+            ("user_agent", pa.string()),
+            ("referer", pa.string()),
+            ("country", pa.string()),
+            ("city", pa.string()),
+        ]
+    )
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that keeps written bytes until they are drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_record_batches(
+    connection,
+    url_id: Optional[int] = None,
+    owner_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = settings.analytics_export_batch_size,
+):
+    schema = export_schema()
+    statement = analytics_partitions.select_visits(
+        connection, url_id=url_id, owner_id=owner_id, start=start, end=end
+    )
+    if statement is None:
+        return
+    result = connection.execution_options(
+        stream_results=True, yield_per=batch_size
+    ).execute(statement)
+    for rows in result.partitions(batch_size):
+        # by name, the partition tables do not share the schema's column order
+        yield pa.RecordBatch.from_arrays(
+            [
+                pa.array([row._mapping[field.name] for row in rows], type=field.type)
+                for field in schema
+            ],
+            schema=schema,
+        )
+
+
+def stream_export(
+    export_format: str = "parquet",
+    url_id: Optional[int] = None,
+    owner_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = settings.analytics_export_batch_size,
+) -> Iterator[bytes]:
+    """Yield the encoded file chunk by chunk, one chunk per record batch"""
+    if pa is None:
+        raise RuntimeError("pyarrow is required for analytics export")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format!r}")
+
+    sink = ChunkSink()
+    schema = export_schema()
+    if export_format == "parquet":
+        writer = pq.ParquetWriter(
+            sink, schema, compression=settings.analytics_export_compression
+        )
+    else:
+        writer = pa.ipc.new_stream(
+            sink,
+            schema,
+            options=pa.ipc.IpcWriteOptions(
+                compression=settings.analytics_export_compression
+            ),
+        )
+
+    with read_engine.connect() as connection:
+        for batch in iter_record_batches(
+            connection, url_id, owner_id, start, end, batch_size
+        ):
+            writer.write_batch(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    writer.close()
+    yield sink.drain()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export click analytics")
+    parser.add_argument("--url-id", type=int)
+    parser.add_argument("--owner-id", type=int)
+    parser.add_argument("--start", type=datetime.fromisoformat)
+    parser.add_argument("--end", type=datetime.fromisoformat)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument(
+        "--batch-size", type=int, default=settings.analytics_export_batch_size
+    )
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+
+    written = 0
+    with open(args.output, "wb") as output:
+        for chunk in stream_export(
+            args.format, args.url_id, args.owner_id, args.start, args.end, args.batch_size
+        ):
+            output.write(chunk)
+            written += len(chunk)
+    print(f"wrote {written} bytes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
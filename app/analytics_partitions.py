@@ -0,0 +1,275 @@
+"""Monthly partitioning and retention for raw click analytics.
+
+Raw visits are written to one table per month (urlanalytics_YYYYMM) that
+share the URLAnalytics columns. Partitions are registered in
+analyticspartition so range queries only touch the months they cover, and
+expired months are dropped as whole tables once their rows are reflected in
+the rollup tables.
+
+    python -m app.analytics_partitions --enforce-retention
+"""
+
+import argparse
+import threading
+import weakref
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import (
+    Column,
+    Connection,
+    Index,
+    MetaData,
+    Select,
+    Table,
+    delete,
+    event,
+    insert,
+    select,
+    union_all,
+    update,
+)
+from sqlmodel import Session
+
+from app.analytics import analytics_service
+from app.config import settings
+from app.database import engine
+from app.models import AnalyticsPartition, URLAnalytics
+from app.utils import as_utc
+from app.visit_buffer import VisitEvent
+
+PARTITION_PREFIX = "urlanalytics_"
+COMPACTION_CHUNK_SIZE = 10_000
+
+partition_metadata = MetaData()
+
+
+def month_start(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def visit_events(rows) -> List[VisitEvent]:
+    """Rollup input for raw analytics rows given as mappings"""
+    return [
+        VisitEvent(
+            url_id=row["url_id"],
+            owner_id=row["user_id"],
+            visited_at=as_utc(row["visited_at"]),
+            ip_address=row["ip_address"],
+            referer=row["referer"],
+        )
+        for row in rows
+    ]
+
+
+class AnalyticsPartitions:
+    def __init__(self):
+        self._tables = {}
+        self._known = set()
+        # partitions each connection created or registered in its transaction
+        self._uncommitted = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def partition_name(self, month: date, legacy: bool = False) -> str:
+        name = f"{PARTITION_PREFIX}{month:%Y%m}"
+        return f"{name}_legacy" if legacy else name
+
+    def table(self, name: str) -> Table:
+        with self._lock:
+            table = self._tables.get(name)
+            if table is None:
+                # same columns as URLAnalytics, without foreign keys so old
+                # partitions can outlive the urls they point to
+                columns = [
+                    Column(
+                        column.name,
+                        column.type,
+                        primary_key=column.primary_key,
+                        nullable=column.nullable,
+                    )
+                    for column in URLAnalytics.__table__.columns
+                ]
+                table = Table(name, partition_metadata, *columns)
+                Index(f"ix_{name}_url_id_visited_at", table.c.url_id, table.c.visited_at)
+                Index(f"ix_{name}_user_id_visited_at", table.c.user_id, table.c.visited_at)
+                self._tables[name] = table
+            return table
+
+    def ensure(
+        self, connection: Connection, month: date, legacy: bool = False
+    ) -> Table:
+        """Create and register the partition for `month` if it does not exist yet"""
+        name = self.partition_name(month, legacy)
+        table = self.table(name)
+        if name in self._known:
+            return table
+
+        registry = AnalyticsPartition.__table__
+        table.create(connection, checkfirst=True)
+        registered = connection.execute(
+            select(registry.c.name).where(registry.c.name == name)
+        ).first()
+        if not registered:
+            # the visit flusher and the legacy move roll rows up in the same
+            # transaction that writes them
+            connection.execute(
+                insert(registry).values(name=name, month=month, rolled_up=True)
+            )
+        self._remember(connection, name)
+        return table
+
+    def _remember(self, connection: Connection, name: str):
+        # the create and registration roll back with the caller's transaction,
+        # so forget the partition again if it does
+        with self._lock:
+            names = self._uncommitted.get(connection)
+            if names is None:
+                names = self._uncommitted[connection] = set()
+                event.listen(connection, "rollback", self._forget)
+            names.add(name)
+            self._known.add(name)
+
+    def _forget(self, connection: Connection):
+        with self._lock:
+            self._known.difference_update(self._uncommitted.pop(connection, ()))
+
+    def insert_rows(self, connection: Connection, rows: List[dict], legacy: bool = False):
+        by_month = defaultdict(list)
+        for row in rows:
+            by_month[month_start(as_utc(row["visited_at"]))].append(row)
+        for month, month_rows in by_month.items():
+            connection.execute(insert(self.ensure(connection, month, legacy)), month_rows)
+
+    def tables_for_range(
+        self,
+        connection: Connection,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[Table]:
+        registry = AnalyticsPartition.__table__
+        statement = select(registry.c.name).order_by(registry.c.month)
+        if start:
+            statement = statement.where(registry.c.month >= month_start(start))
+        if end:
+            statement = statement.where(registry.c.month <= month_start(end))
+        return [self.table(name) for name in connection.execute(statement).scalars()]
+
+    def select_visits(
+        self,
+        connection: Connection,
+        url_id: Optional[int] = None,
+        owner_id: Optional[int] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Optional[Select]:
+        """UNION ALL over the partitions covering [start, end), None when there are none"""
+        selects = []
+        for table in self.tables_for_range(connection, start, end):
+            statement = select(*table.c)
+            if url_id is not None:
+                statement = statement.where(table.c.url_id == url_id)
+            if owner_id is not None:
+                statement = statement.where(table.c.user_id == owner_id)
+            if start:
+                statement = statement.where(table.c.visited_at >= start)
+            if end:
+                statement = statement.where(table.c.visited_at < end)
+            selects.append(statement)
+        if not selects:
+            return None
+        if len(selects) == 1:
+            return selects[0]
+        return union_all(*selects)
+
+    def compact(self, name: str):
+        """Fold a partition that is not rolled up yet into the rollup tables.
+
+        Only partitions moved by an earlier version of migration 2 need this.
+        """
+        table = self.table(name)
+        last_id = 0
+        with Session(engine) as session:
+            while True:
+                rows = (
+                    session.execute(
+                        select(
+                            table.c.id,
+                            table.c.url_id,
+                            table.c.user_id,
+                            table.c.visited_at,
+                            table.c.ip_address,
+                            table.c.referer,
+                        )
+                        .where(table.c.id > last_id)
+                        .order_by(table.c.id)
+                        .limit(COMPACTION_CHUNK_SIZE)
+                    )
+                    .mappings()
+                    .all()
+                )
+                if not rows:
+                    break
+                events = visit_events(rows)
+                analytics_service.record_visits(session, events)
+                analytics_service.record_unique_visitors(events)
+                last_id = rows[-1]["id"]
+
+            registry = AnalyticsPartition.__table__
+            session.execute(
+                update(registry).where(registry.c.name == name).values(rolled_up=True)
+            )
+            session.commit()
+
+    def enforce_retention(self) -> List[str]:
+        """Drop partitions older than analytics_retention_months, compacting them first"""
+        registry = AnalyticsPartition.__table__
+        cutoff = add_months(
+            month_start(datetime.now(timezone.utc)), -settings.analytics_retention_months
+        )
+        with engine.connect() as connection:
+            expired = connection.execute(
+                select(registry.c.name, registry.c.rolled_up).where(
+                    registry.c.month < cutoff
+                )
+            ).all()
+
+        dropped = []
+        for name, rolled_up in expired:
+            if not rolled_up:
+                self.compact(name)
+            with engine.begin() as connection:
+                self.table(name).drop(connection, checkfirst=True)
+                connection.execute(delete(registry).where(registry.c.name == name))
+            self._known.discard(name)
+            dropped.append(name)
+        return dropped
+
+
+analytics_partitions = AnalyticsPartitions()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage url analytics partitions")
+    parser.add_argument(
+        "--enforce-retention",
+        action="store_true",
+        help="drop partitions older than analytics_retention_months",
+    )
+    args = parser.parse_args(argv)
+
+    with engine.connect() as connection:
+        for table in analytics_partitions.tables_for_range(connection):
+            print(table.name)
+    if args.enforce_retention:
+        for name in analytics_partitions.enforce_retention():
+            print(f"dropped {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,33 +5,29 @@ import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
-from pwdlib import PasswordHash
 from sqlmodel import Session, select
 
-from app.database import get_session
-from app.models import User
+from app.auth_cache import Principal, decode_token, get_principal
+from app.models import User, UserRole
 from app.config import settings
+from app.password_hashing import password_pool
 
 
-password_hash = PasswordHash.recommended()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-def verify_password(plain_password, hashed_password):
-    return password_hash.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return password_hash.hash(password)
-
-
-def authenticate_user(session: Session, username: str, password: str):
+async def authenticate_user(session: Session, username: str, password: str):
     statement = select(User).where(User.username == username)
     user = session.exec(statement).first()
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, updated_hash = await password_pool.verify(password, user.hashed_password)
+    if not verified:
         return False
+    if updated_hash:
+        user.hashed_password = updated_hash
+        session.add(user)
+        session.commit()
     return user
 
 
@@ -43,7 +39,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(
-        to_encode, settings.secret_key, algorithm=settings.aglorithm
+        to_encode, settings.secret_key, algorithm=settings.algorithm
     )
     return encoded_jwt
 
@@ -54,47 +50,53 @@ def refresh_access_token(token: str) -> str:
         detail="Invalid token",
     )
     try:
-        payload = jwt.decode(
-            token, settings.secret_key, algorithms=[settings.alogrithm]
-        )
+        payload = decode_token(token)
     except InvalidTokenError:
         raise invalid_token_exception
     new_token = create_access_token(payload)
     return new_token
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)],
+) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(
-            token, settings.secret_key, algorithms=[settings.alogrithm]
-        )
+        payload = decode_token(token)
         # username = payload.get("sub")
         # if username is None:
         #     raise credentials_exception
         # token_data = TokenData(username=username)
     except InvalidTokenError:
         raise credentials_exception
-    session = get_session()
-    statement = select(User).where(User.username == payload.get("username"))
-    user = session.exec(statement).first()
+    user = await get_principal(payload)
     if user is None:
         raise credentials_exception
     return user
 
 
 async def get_current_active_user(
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[Principal, Depends(get_current_user)],
 ):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
+async def get_current_admin_user(
+    current_user: Annotated[Principal, Depends(get_current_active_user)],
+):
+    if current_user.role != UserRole.ADMIN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
+        )
+    return current_user
+
+
 # @app.post("/token")
 # async def login_for_access_token(
 #     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
@@ -0,0 +1,131 @@
+"""Caches that keep authenticated requests off the database.
+
+Verified tokens are kept in a bounded LRU until they expire, so a token
+is signature checked once per worker. The user behind it is cached as a
+small `Principal` in process and in redis. Changes to a user's role or
+active flag made through the ORM evict it everywhere once the session
+commits; code that updates users with a bulk UPDATE must call
+`invalidate_principal` itself.
+"""
+
+import time
+from typing import NamedTuple, Optional
+
+import jwt
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.database import async_engine
+from app.local_cache import LocalCache
+from app.models import User, UserRole
+from app.redis_client import async_redis_service, redis_service
+
+PRINCIPAL_FIELDS = ("is_active", "role")
+
+
+class Principal(NamedTuple):
+    id: int
+    username: str
+    role: UserRole
+    is_active: bool
+
+
+token_cache = LocalCache(
+    max_size=settings.auth_token_cache_size,
+    ttl_seconds=settings.access_token_expire_minutes * 60,
+)
+principal_cache = LocalCache(
+    max_size=settings.auth_token_cache_size,
+    ttl_seconds=settings.auth_principal_local_seconds,
+)
+
+
+def get_principal_key(user_id: int):
+    return f"principal:{user_id}"
+
+
+def decode_token(token: str) -> dict:
+    """Verified payload of a token, raises InvalidTokenError like jwt.decode"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    ttl = payload["exp"] - time.time() if "exp" in payload else None
+    if ttl is None or ttl > 0:
+        token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+
+def to_principal(user: User) -> Principal:
+    return Principal(user.id, user.username, user.role, user.is_active)
+
+
+async def get_principal(payload: dict) -> Optional[Principal]:
+    user_id = payload.get("user_id")
+    if user_id is not None:
+        principal = principal_cache.get(user_id)
+        if principal:
+            return principal
+        cached = await async_redis_service.get_cache(get_principal_key(user_id))
+        if cached:
+            principal = Principal(
+                cached["id"], cached["username"], UserRole(cached["role"]), cached["is_active"]
+            )
+            principal_cache.set(user_id, principal)
+            return principal
+
+    async with AsyncSession(async_engine) as session:
+        if user_id is not None:
+            statement = select(User).where(User.id == user_id)
+        else:
+            # tokens issued before user_id was added to the claims
+            statement = select(User).where(User.username == payload.get("sub"))
+        user = (await session.exec(statement)).first()
+    if user is None:
+        return None
+    principal = to_principal(user)
+    await async_redis_service.set_cache(
+        get_principal_key(user.id),
+        principal._asdict(),
+        expire=settings.auth_principal_cache_seconds,
+    )
+    principal_cache.set(user.id, principal)
+    return principal
+
+
+def invalidate_principal(user_id: int):
+    principal_cache.delete(user_id)
+    redis_service.delete_cache(get_principal_key(user_id))
+    redis_service.publish_message(settings.auth_invalidation_channel, {"user_ids": [user_id]})
+
+
+def handle_auth_invalidation(message: dict):
+    for user_id in message.get("user_ids", []):
+        principal_cache.delete(user_id)
+
+
+@event.listens_for(User, "after_update")
+def _track_principal_change(mapper, connection, target: User):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in PRINCIPAL_FIELDS):
+        state.session.info.setdefault("changed_principals", set()).add(target.id)
+
+
+@event.listens_for(User, "after_delete")
+def _track_principal_delete(mapper, connection, target: User):
+    inspect(target).session.info.setdefault("changed_principals", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_principals(session: Session):
+    # evicting after the commit, a concurrent miss cannot re-cache the old row
+    for user_id in session.info.pop("changed_principals", ()):
+        invalidate_principal(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_principals(session: Session):
+    session.info.pop("changed_principals", None)
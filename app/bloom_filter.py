@@ -0,0 +1,206 @@
+"""Bloom filter of every allocated short code, kept as a redis bitmap.
+
+A definite "absent" answer lets lookups reject unknown codes without a
+database round trip. Codes are never reused, so bits are never cleared:
+a deactivated code stays in the filter and keeps answering 410 from the
+database and the negative cache instead of 404.
+
+    python -m app.bloom_filter --rebuild
+"""
+
+import argparse
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from sqlmodel import Session, select
+
+from app.config import settings
+from app.database import engine
+from app.models import ShortURL
+from app.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+REBUILD_CHUNK_SIZE = 50_000
+
+# a missing bitmap must stay missing until it is rebuilt, a SETBIT on it
+# would recreate a nearly empty filter that answers "absent" for every
+# existing code
+SETBITS_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+end
+return 1
+"""
+
+
+class BloomFilter:
+    def __init__(self, key: str, capacity: int, error_rate: float):
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        # adds that could not reach redis, retried by flush_pending
+        self._pending: List[str] = []
+        self.setbits_if_exists = redis_client.register_script(SETBITS_IF_EXISTS_SCRIPT)
+        self._pending_lock = threading.Lock()
+
+    def positions(self, item: str) -> List[int]:
+        # double hashing: k positions from two independent 64 bit hashes
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add_many(self, items: Iterable[str]) -> bool:
+        with self._pending_lock:
+            items = self._pending + list(items)
+            self._pending = []
+        if not items:
+            return True
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for item in items:
+                self.setbits_if_exists(
+                    keys=[self.key], args=self.positions(item), client=pipe
+                )
+            pipe.execute()
+        except Exception as e:
+            with self._pending_lock:
+                self._pending = items + self._pending
+            return False
+        return True
+
+    def add(self, item: str) -> bool:
+        return self.add_many([item])
+
+    def flush_pending(self) -> bool:
+        return self.add_many([])
+
+    def maintain(self):
+        """Retry pending adds, and rebuild the bitmap if redis lost it"""
+        self.flush_pending()
+        try:
+            missing = not redis_client.exists(self.key)
+        except Exception as e:
+            return
+        if missing:
+            self.rebuild_once()
+
+    async def might_contain(self, item: str) -> Optional[bool]:
+        """False if the code was never allocated, None when redis cannot tell"""
+        try:
+            pipe = async_redis_client.pipeline(transaction=False)
+            pipe.exists(self.key)
+            for position in self.positions(item):
+                pipe.getbit(self.key, position)
+            exists, *bits = await pipe.execute()
+        except Exception as e:
+            return None
+        if not exists:
+            return None
+        return all(bits)
+
+    def rebuild(self) -> int:
+        """Rebuild the bitmap from shorturl and atomically swap it in"""
+        started_at = datetime.now(timezone.utc)
+        bits = bytearray(math.ceil(self.size / 8))
+        count = 0
+        last_id = 0
+        with Session(engine) as session:
+            while True:
+                rows = session.exec(
+                    select(ShortURL.id, ShortURL.short_code)
+                    .where(ShortURL.id > last_id)
+                    .order_by(ShortURL.id)
+                    .limit(REBUILD_CHUNK_SIZE)
+                ).all()
+                if not rows:
+                    break
+                for row in rows:
+                    for position in self.positions(row.short_code):
+                        # redis bitmaps number bits from the most significant bit
+                        bits[position >> 3] |= 0x80 >> (position & 7)
+                count += len(rows)
+                last_id = rows[-1].id
+
+        building_key = f"{self.key}:building"
+        redis_client.set(building_key, bytes(bits))
+        redis_client.rename(building_key, self.key)
+
+        # codes created while the snapshot was read went to the old bitmap
+        with Session(engine) as session:
+            recent = session.exec(
+                select(ShortURL.short_code).where(
+                    ShortURL.created_at >= started_at - timedelta(seconds=5)
+                )
+            ).all()
+        self.add_many(recent)
+        return count
+
+    def rebuild_once(self) -> Optional[int]:
+        """Rebuild unless another worker already holds the rebuild lock"""
+        lock_key = f"{self.key}:rebuild_lock"
+        try:
+            if not redis_client.set(lock_key, "1", nx=True, ex=600):
+                return None
+        except Exception as e:
+            return None
+        try:
+            started = time.monotonic()
+            count = self.rebuild()
+            logger.info(
+                "bloom filter rebuilt with %d codes in %.1fs: %s",
+                count,
+                time.monotonic() - started,
+                self.stats(),
+            )
+            return count
+        except Exception as e:
+            # lookups treat a missing filter as unknown, so never block startup on it
+            logger.warning("bloom filter rebuild failed: %s", e)
+            return None
+        finally:
+            try:
+                redis_client.delete(lock_key)
+            except Exception as e:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "bits": self.size,
+            "hash_count": self.hash_count,
+            "memory_bytes": math.ceil(self.size / 8),
+        }
+
+
+short_code_filter = BloomFilter(
+    "bloom:short_codes",
+    capacity=settings.bloom_filter_capacity,
+    error_rate=settings.bloom_filter_error_rate,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Short code bloom filter")
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        print(f"indexed {short_code_filter.rebuild()} codes")
+    print(short_code_filter.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Preload the redirect cache with the most visited active urls.
+
+Runs once per deploy from the lifespan hook, so a cold redis after a
+restart does not send every redirect to the database at once. Entries
+are written with SET NX, anything cached by live traffic in the meantime
+is left alone.
+
+    python -m app.cache_warmup --max-urls 50000 --budget-mb 32
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import or_, true
+from sqlmodel import Session, select
+
+from app.config import settings
+from app.database import read_engine
+from app.models import ShortURL
+from app.redirect_cache import encode_entry
+from app.redis_client import redis_client
+from app.url_service import url_service
+from app.utils import get_url_cache_key
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = "cache_warmup:lock"
+# rough redis bookkeeping per string key (dict entry, robj, sds headers, expiry)
+KEY_OVERHEAD_BYTES = 80
+
+
+class CacheWarmer:
+    def __init__(self, chunk_size: int, max_urls: int, memory_budget_mb: int):
+        self.chunk_size = chunk_size
+        self.max_urls = max_urls
+        self.memory_budget_mb = memory_budget_mb
+
+    def warm(
+        self, max_urls: Optional[int] = None, memory_budget_mb: Optional[int] = None
+    ) -> dict:
+        """Write the hottest urls to redis in pipelined chunks until a limit is hit"""
+        max_urls = self.max_urls if max_urls is None else max_urls
+        budget = (
+            self.memory_budget_mb if memory_budget_mb is None else memory_budget_mb
+        ) * 1024 * 1024
+        started = time.monotonic()
+        stats = {"read": 0, "written": 0, "bytes": 0}
+
+        statement = (
+            select(
+                ShortURL.id,
+                ShortURL.owner_id,
+                ShortURL.short_code,
+                ShortURL.original_url,
+                ShortURL.expires_at,
+            )
+            .where(
+                ShortURL.is_active == true(),
+                or_(
+                    ShortURL.expires_at.is_(None),
+                    ShortURL.expires_at > datetime.now(timezone.utc),
+                ),
+            )
+            .order_by(
+                ShortURL.visit_count.desc(),
+                ShortURL.last_visited.desc(),
+                ShortURL.id.desc(),
+            )
+            .limit(max_urls)
+            .execution_options(yield_per=self.chunk_size)
+        )
+        with Session(read_engine) as session:
+            for rows in session.execute(statement).partitions():
+                entries = {}
+                for row in rows:
+                    entry = encode_entry(row)
+                    size = len(row.short_code) + len(entry) + KEY_OVERHEAD_BYTES
+                    if stats["bytes"] + size > budget:
+                        break
+                    entries[get_url_cache_key(row.short_code)] = entry
+                    stats["bytes"] += size
+                stats["read"] += len(entries)
+                stats["written"] += self._write(entries)
+                logger.info(
+                    "cache warm-up: %d urls read, %d written, %.1fMB in %.1fs",
+                    stats["read"],
+                    stats["written"],
+                    stats["bytes"] / 1024 / 1024,
+                    time.monotonic() - started,
+                )
+                if len(entries) < len(rows):
+                    logger.info("cache warm-up stopped at the memory budget")
+                    break
+        stats["seconds"] = round(time.monotonic() - started, 3)
+        return stats
+
+    def _write(self, entries: dict) -> int:
+        if not entries:
+            return 0
+        pipe = redis_client.pipeline(transaction=False)
+        for key, entry in entries.items():
+            pipe.set(key, entry, ex=url_service.url_cache_ttl, nx=True)
+        return sum(1 for result in pipe.execute() if result)
+
+    def warm_once(self) -> Optional[dict]:
+        """Warm unless another worker is already doing it"""
+        try:
+            if not redis_client.set(LOCK_KEY, "1", nx=True, ex=600):
+                return None
+        except Exception as e:
+            return None
+        try:
+            return self.warm()
+        except Exception as e:
+            # a cold cache is slower, not broken, so never block startup on it
+            logger.warning("cache warm-up failed: %s", e)
+            return None
+        finally:
+            try:
+                redis_client.delete(LOCK_KEY)
+            except Exception as e:
+                # the lock expires on its own
+                pass
+
+
+cache_warmer = CacheWarmer(
+    chunk_size=settings.cache_warmup_chunk_size,
+    max_urls=settings.cache_warmup_max_urls,
+    memory_budget_mb=settings.cache_warmup_memory_budget_mb,
+)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Preload the redirect cache")
+    parser.add_argument("--max-urls", type=int)
+    parser.add_argument("--budget-mb", type=int)
+    args = parser.parse_args(argv)
+
+    print(cache_warmer.warm(max_urls=args.max_urls, memory_budget_mb=args.budget_mb))
+
+
+if __name__ == "__main__":
+    main()
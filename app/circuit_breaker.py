@@ -0,0 +1,41 @@
+import time
+from typing import Optional
+
+
+class CircuitBreaker:
+    """Skips calls to an unhealthy dependency.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    `allow_request` returns False for `reset_timeout` seconds. Then a single
+    trial call is let through: success closes the circuit, another failure
+    keeps it open for a further `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            # half open: let this caller probe, everyone else keeps skipping
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
@@ -0,0 +1,215 @@
+import hashlib
+import secrets
+import string
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from app.config import settings
+from app.database import engine
+from app.models import ShortCodeKey, ShortCodeSequence
+from app.redis_client import redis_client
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+
+
+def base62_encode(number: int, length: int = 0) -> str:
+    digits = []
+    while number:
+        number, remainder = divmod(number, 62)
+        digits.append(BASE62_ALPHABET[remainder])
+    return "".join(reversed(digits)).rjust(length, BASE62_ALPHABET[0])
+
+
+class DatabaseIdLeaser:
+    """Leases id blocks from a row in the shortcodesequence table"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def lease(self, size: int) -> range:
+        table = ShortCodeSequence.__table__
+        with Session(engine) as session:
+            while True:
+                # the UPDATE takes the row (or database) write lock, so the
+                # SELECT below reads our own increment and nobody else's
+                result = session.execute(
+                    update(table)
+                    .where(table.c.name == self.name)
+                    .values(next_value=table.c.next_value + size)
+                )
+                if result.rowcount:
+                    end = session.execute(
+                        select(table.c.next_value).where(table.c.name == self.name)
+                    ).scalar_one()
+                    session.commit()
+                    return range(end - size, end)
+                try:
+                    session.execute(insert(table).values(name=self.name, next_value=0))
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+
+
+class RedisIdLeaser:
+    """Leases id blocks with a single INCRBY on a redis counter"""
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def lease(self, size: int) -> range:
+        end = redis_client.incrby(self.key, size)
+        return range(end - size, end)
+
+
+def load_or_create_secret(name: str) -> str:
+    """Return the permutation key stored under `name`, generating it on first use"""
+    table = ShortCodeKey.__table__
+    query = select(table.c.secret).where(table.c.name == name)
+    with Session(engine) as session:
+        secret = session.execute(query).scalar()
+        if secret is not None:
+            return secret
+        try:
+            session.execute(insert(table).values(name=name, secret=secrets.token_hex(32)))
+            session.commit()
+        except IntegrityError:
+            # another worker stored its key first, use that one
+            session.rollback()
+        return session.execute(query).scalar_one()
+
+
+class CodeAllocator(ABC):
+    """Hands out unique short codes from leased blocks of sequence ids.
+
+    Each worker leases `block_size` ids at a time and allocates from the
+    block locally, so a code never needs an existence check and only one in
+    `block_size` allocations talks to the lease store.
+    """
+
+    def __init__(self, leaser, block_size: int, offset: int = 0):
+        self.leaser = leaser
+        self.block_size = block_size
+        self.offset = offset
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def encode(self, value: int) -> str:
+        """Map a sequence value to its short code"""
+
+    def allocate(self) -> str:
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> List[str]:
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                if self._next >= self._end:
+                    block = self.leaser.lease(max(self.block_size, count - len(ids)))
+                    self._next, self._end = block.start, block.stop
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+        return [self.encode(self.offset + value) for value in ids]
+
+
+class CounterCodeAllocator(CodeAllocator):
+    """Sequential base62 codes, the shortest possible codes for a given volume"""
+
+    def encode(self, value: int) -> str:
+        return base62_encode(value)
+
+
+class PermutedCodeAllocator(CodeAllocator):
+    """Fixed length base62 codes from a keyed permutation of the sequence.
+
+    A balanced Feistel network shuffles the sequence over the smallest even
+    bit width covering 62**length values; outputs outside that range are
+    re-encrypted (cycle walking), so the mapping stays a bijection and
+    consecutive ids give unrelated codes.
+
+    Without an explicit `secret` the key is generated once and stored in the
+    database under `key_name`, so every worker permutes the same way. It is
+    loaded on first use because the tables may not exist at import time.
+    """
+
+    rounds = 4
+
+    def __init__(
+        self,
+        leaser,
+        block_size: int,
+        length: int,
+        secret: Optional[str] = None,
+        key_name: str = "short_code:permuted",
+    ):
+        super().__init__(leaser, block_size)
+        self.length = length
+        self.domain = 62**length
+        self.half_bits = ((self.domain - 1).bit_length() + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.key_name = key_name
+        self._key = secret.encode() if secret else None
+
+    @property
+    def key(self) -> bytes:
+        if self._key is None:
+            self._key = load_or_create_secret(self.key_name).encode()
+        return self._key
+
+    def _round(self, index: int, key: bytes, value: int) -> int:
+        digest = hashlib.blake2b(
+            value.to_bytes(8, "big"),
+            key=key[:64],
+            person=index.to_bytes(16, "big"),
+            digest_size=8,
+        ).digest()
+        return int.from_bytes(digest, "big") & self.half_mask
+
+    def _permute(self, value: int) -> int:
+        key = self.key
+        left, right = value >> self.half_bits, value & self.half_mask
+        for index in range(self.rounds):
+            left, right = right, left ^ self._round(index, key, right)
+        return (left << self.half_bits) | right
+
+    def encode(self, value: int) -> str:
+        if value >= self.domain:
+            raise ValueError("Short code space exhausted, increase short_code_length")
+        value = self._permute(value)
+        while value >= self.domain:
+            value = self._permute(value)
+        return base62_encode(value, self.length)
+
+
+def build_code_allocator() -> CodeAllocator:
+    name = f"short_code:{settings.short_code_strategy}"
+    if settings.short_code_block_source == "redis":
+        leaser = RedisIdLeaser(f"{name}:counter")
+    else:
+        leaser = DatabaseIdLeaser(name)
+
+    if settings.short_code_strategy == "counter":
+        # start at 62**6 so counter codes never overlap the legacy random
+        # 6 character codes
+        return CounterCodeAllocator(
+            leaser, settings.short_code_block_size, offset=62**6
+        )
+    # never derived from secret_key, rotating the token signing key must not
+    # change which codes the sequence maps to
+    return PermutedCodeAllocator(
+        leaser,
+        settings.short_code_block_size,
+        length=settings.short_code_length,
+        secret=settings.short_code_secret,
+        key_name=name,
+    )
+
+
+code_allocator = build_code_allocator()
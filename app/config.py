@@ -1,22 +1,161 @@
+from typing import Dict, List, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
     database_url: str = "sqlite:///./url_shortner.db"
+    # derived from database_url when not set, e.g. sqlite+aiosqlite:// for sqlite://
+    async_database_url: Optional[str] = None
+    # redirect lookups and exports read from here when set
+    database_replica_url: Optional[str] = None
+    async_database_replica_url: Optional[str] = None
+    database_echo: bool = False
+    database_pool_size: int = 10
+    database_max_overflow: int = 20
+    database_pool_timeout_seconds: float = 30
+    database_pool_recycle_seconds: int = 30 * 60
+    database_pool_pre_ping: bool = True
+    # applied to every new sqlite connection, journal_mode=wal lets readers
+    # run alongside the single writer
+    sqlite_pragmas: Dict[str, str] = {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": "5000",
+        "cache_size": "-65536",
+        "mmap_size": "268435456",
+    }
 
     redis_url: str = "redis://localhost:6379"
+    # standalone, sentinel or cluster
+    redis_mode: str = "standalone"
+    # host:port of each sentinel, the master's db and credentials come from redis_url
+    redis_sentinels: List[str] = []
+    redis_sentinel_service: str = "mymaster"
+    # async client used on the request path, short timeouts so a slow redis
+    # degrades to cache misses instead of slow requests
+    redis_max_connections: int = 100
+    redis_socket_timeout: float = 0.25
+    # sync client used by background threads and CLIs, bloom rebuilds write
+    # a large bitmap in one command
+    redis_sync_max_connections: int = 50
+    redis_sync_socket_timeout: float = 5.0
+    redis_health_check_interval: int = 30
+    redis_circuit_failure_threshold: int = 5
+    redis_circuit_reset_seconds: float = 5.0
     default_cache_expiry_seconds: int = 60 * 60
+    # how long an entry may be served stale past default_cache_expiry_seconds
+    cache_stale_seconds: int = 5 * 60
+    cache_early_refresh_beta: float = 1.0
+    cache_lock_ms: int = 2000
+    cache_lock_wait_ms: int = 500
+
+    local_cache_max_size: int = 1024
+    local_cache_ttl_seconds: int = 30
+    cache_invalidation_channel: str = "url_cache_invalidation"
+    # redis ttl for unknown and gone codes
+    negative_cache_seconds: int = 60
+
+    bloom_filter_enabled: bool = True
+    # 10M codes at 0.1% false positives is a ~17MB bitmap with 10 hashes
+    bloom_filter_capacity: int = 10_000_000
+    bloom_filter_error_rate: float = 0.001
+    bloom_filter_retry_seconds: float = 5.0
+
+    cache_warmup_on_startup: bool = True
+    cache_warmup_max_urls: int = 100_000
+    cache_warmup_chunk_size: int = 1000
+    # estimated redis memory the warm-up may fill, keys and values plus per-key overhead
+    cache_warmup_memory_budget_mb: int = 64
 
     secret_key: str = "random secret key"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    # argon2id cost, changing these rehashes each password on its next login
+    password_hash_time_cost: int = 3
+    password_hash_memory_cost_kib: int = 64 * 1024
+    password_hash_parallelism: int = 4
+    password_hash_workers: int = 4
+    # hashes queued or running before new ones are turned away with a 503
+    password_hash_max_pending: int = 64
+    auth_token_cache_size: int = 10_000
+    # principal (id, role, is_active) lifetimes, the local copy also bounds how
+    # long a worker that missed an invalidation message keeps a stale role
+    auth_principal_local_seconds: int = 30
+    auth_principal_cache_seconds: int = 5 * 60
+    auth_invalidation_channel: str = "auth_cache_invalidation"
 
     rate_limit_per_minute: int = 60
+    rate_limit_authenticated_per_minute: int = 120
+    # "hybrid" decides locally and syncs counts to redis in the background,
+    # "redis" runs a script per request and falls back to local buckets
+    rate_limit_mode: str = "hybrid"
+    # "sliding_window" or "token_bucket", used in "redis" mode
+    rate_limit_algorithm: str = "sliding_window"
+    rate_limit_sync_interval_seconds: float = 1.0
+    rate_limit_local_max_keys: int = 100_000
+    # path prefix -> requests per minute, e.g. {"/auth/login/": 10}
+    rate_limit_routes: Dict[str, int] = {}
 
     base_url: str = "http://localhost:8000"
+
+    # "permuted" for non guessable fixed length codes, "counter" for the shortest codes
+    short_code_strategy: str = "permuted"
+    # where worker id blocks are leased from: "database" or "redis"
+    short_code_block_source: str = "database"
+    short_code_block_size: int = 1000
+    short_code_length: int = 7
+    # permutation key for "permuted" codes, generated and stored in the
+    # database when unset; changing it once codes exist causes collisions
+    short_code_secret: Optional[str] = None
+
+    url_counts_cache_seconds: int = 24 * 60 * 60
+
+    bulk_create_max_items: int = 50_000
+    bulk_create_chunk_size: int = 1000
     url_default_expiry_days: int = 30
+    expiry_sweep_interval_seconds: int = 60
+    expiry_sweep_batch_size: int = 500
+    url_dedup_enabled: bool = False
+    # also key dedup on the title; changing this stops matching older links
+    url_dedup_match_title: bool = False
 
     visit_threshold: int = 100
+    visit_buffer_max_size: int = 1000
+    visit_buffer_flush_interval_seconds: float = 1.0
+    visit_buffer_max_pending: int = 100_000
+
+    event_stream: str = "url_events"
+    # approximate, redis trims whole macro nodes
+    event_stream_maxlen: int = 100_000
+    event_dead_letter_stream: str = "url_events:dead"
+    # also emit a url_visited event per click when visits are flushed
+    event_stream_visits: bool = False
+    event_publish_batch_size: int = 500
+    event_publish_interval_seconds: float = 0.5
+    event_publish_max_pending: int = 50_000
+    event_consumer_batch_size: int = 100
+    # must stay below redis_sync_socket_timeout
+    event_consumer_block_ms: int = 2000
+    # pending entries idle this long are claimed by another consumer and retried
+    event_claim_idle_ms: int = 60_000
+    event_max_deliveries: int = 5
+
+    analytics_days: int = 30
+    analytics_hours: int = 24
+    analytics_top_referers: int = 10
+    analytics_retention_months: int = 12
+    analytics_retention_check_seconds: int = 6 * 60 * 60
+    analytics_export_batch_size: int = 10_000
+    analytics_export_compression: str = "zstd"
+
+    # window name -> half life in seconds
+    heavy_hitters_windows: Dict[str, float] = {"5m": 300, "1h": 3600}
+    heavy_hitters_capacity: int = 1000
+    heavy_hitters_referer_capacity: int = 20
+    heavy_hitters_max_urls: int = 10_000
+    hot_urls_prewarm_count: int = 200
+    hot_urls_prewarm_interval_seconds: float = 10.0
     expiration_warning_days: int = 7
 
     # class Config:
@@ -1,9 +1,78 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.config import settings
 from app.models import User
 
-engine = create_engine(settings.database_url, echo=True)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(
+    database_url: str, async_database_url: str = settings.async_database_url
+) -> str:
+    if async_database_url:
+        return async_database_url
+    scheme, _, rest = database_url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+def get_engine_options(database_url: str) -> dict:
+    url = make_url(database_url)
+    options = {"echo": settings.database_echo}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # in-memory databases live on a single connection, there is no pool to size
+        return options
+    options.update(
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout_seconds,
+        pool_recycle=settings.database_pool_recycle_seconds,
+        pool_pre_ping=settings.database_pool_pre_ping,
+    )
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in settings.sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def configure_engine(engine: Engine) -> Engine:
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+def build_engines(database_url: str, async_database_url: str = None):
+    async_database_url = get_async_database_url(database_url, async_database_url)
+    sync_engine = configure_engine(
+        create_engine(database_url, **get_engine_options(database_url))
+    )
+    async_engine = create_async_engine(
+        async_database_url, **get_engine_options(async_database_url)
+    )
+    configure_engine(async_engine.sync_engine)
+    return sync_engine, async_engine
+
+
+engine, async_engine = build_engines(settings.database_url, settings.async_database_url)
+
+# reads that tolerate replication lag, the primary when no replica is configured
+if settings.database_replica_url:
+    read_engine, async_read_engine = build_engines(
+        settings.database_replica_url, settings.async_database_replica_url
+    )
+else:
+    read_engine, async_read_engine = engine, async_engine
 
 
 def create_db_and_tables():
@@ -13,3 +82,8 @@ def create_db_and_tables():
 def get_session() -> Session:
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session() -> AsyncSession:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
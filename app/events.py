@@ -0,0 +1,242 @@
+"""Durable domain events on a redis stream.
+
+The app appends events (url_created, visit_threshold_reached,
+url_expiring_soon, optionally url_visited) through `event_publisher`,
+which buffers them in memory and writes them with pipelined XADD calls
+from a worker thread, so publishing never waits on redis. Downstream
+services read them with `EventConsumer` in a consumer group: entries are
+acked once their handler succeeds, entries left pending by a failed
+handler or a dead consumer are reclaimed with XAUTOCLAIM and retried,
+and after `event_max_deliveries` attempts they move to a dead letter
+stream.
+
+    python -m app.events consume --group audit --consumer audit-1
+    python -m app.events info --group audit
+"""
+
+import argparse
+import json
+import logging
+import socket
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from redis.exceptions import ResponseError
+
+from app.config import settings
+from app.redis_client import redis_client
+from app.write_behind import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("url_created", "visit_threshold_reached", "url_expiring_soon", "url_visited")
+
+
+class Event(NamedTuple):
+    type: str
+    data: dict
+    created_at: str
+
+    def fields(self) -> dict:
+        return {"type": self.type, "data": json.dumps(self.data), "created_at": self.created_at}
+
+
+class EventPublisher(WriteBehindBuffer):
+    """Buffers events in memory and appends them to the stream in batches.
+
+    Publishing never waits on redis. If the stream cannot be written the
+    events are kept, oldest dropped first past `max_pending`.
+    """
+
+    def __init__(
+        self,
+        stream: str,
+        maxlen: int,
+        batch_size: int,
+        flush_interval: float,
+        max_pending: int,
+    ):
+        super().__init__(self.write, batch_size, flush_interval, max_pending)
+        self.stream = stream
+        self.maxlen = maxlen
+
+    def publish(self, event_type: str, data: dict):
+        self.add(Event(event_type, data, datetime.now(timezone.utc).isoformat()))
+
+    def write(self, events: List[Event]):
+        pipe = redis_client.pipeline(transaction=False)
+        for event in events:
+            pipe.xadd(self.stream, event.fields(), maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+
+
+class EventConsumer:
+    """Reads the event stream as one member of a consumer group.
+
+    `handlers` maps an event type to a callable taking the event data, types
+    without a handler are acked and skipped. A handler that raises leaves its
+    entry pending, it is retried once it has been idle for `claim_idle_ms`.
+    """
+
+    def __init__(
+        self,
+        group: str,
+        consumer: str,
+        handlers: Dict[str, Callable[[dict], None]],
+        stream: str = settings.event_stream,
+        dead_letter_stream: str = settings.event_dead_letter_stream,
+        batch_size: int = settings.event_consumer_batch_size,
+        block_ms: int = settings.event_consumer_block_ms,
+        claim_idle_ms: int = settings.event_claim_idle_ms,
+        max_deliveries: int = settings.event_max_deliveries,
+    ):
+        self.group = group
+        self.consumer = consumer
+        self.handlers = handlers
+        self.stream = stream
+        self.dead_letter_stream = dead_letter_stream
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self._claim_cursor = "0-0"
+        self._stopped = threading.Event()
+
+    def ensure_group(self):
+        try:
+            # a new group starts at the beginning of whatever the stream still holds
+            redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _handle(self, message_id: str, fields: Optional[dict]) -> bool:
+        if not fields:
+            # trimmed from the stream while it was pending
+            return True
+        handler = self.handlers.get(fields.get("type"))
+        if handler is None:
+            return True
+        try:
+            handler(json.loads(fields["data"]))
+            return True
+        except Exception as e:
+            logger.warning("event %s (%s) failed: %s", message_id, fields.get("type"), e)
+            return False
+
+    def _process(self, messages: list) -> int:
+        acked = [message_id for message_id, fields in messages if self._handle(message_id, fields)]
+        if acked:
+            redis_client.xack(self.stream, self.group, *acked)
+        return len(acked)
+
+    def _dead_letter(self, messages: list) -> list:
+        """Move entries delivered too often to the dead letter stream, return the rest"""
+        if not messages:
+            return messages
+        pending = redis_client.xpending_range(
+            self.stream,
+            self.group,
+            min=messages[0][0],
+            max=messages[-1][0],
+            count=len(messages),
+            consumername=self.consumer,
+        )
+        deliveries = {entry["message_id"]: entry["times_delivered"] for entry in pending}
+        retry, dead = [], []
+        for message_id, fields in messages:
+            if fields and deliveries.get(message_id, 0) > self.max_deliveries:
+                dead.append((message_id, fields))
+            else:
+                retry.append((message_id, fields))
+        if dead:
+            pipe = redis_client.pipeline(transaction=False)
+            for message_id, fields in dead:
+                pipe.xadd(
+                    self.dead_letter_stream,
+                    {**fields, "source_id": message_id, "group": self.group},
+                    maxlen=settings.event_stream_maxlen,
+                    approximate=True,
+                )
+            pipe.xack(self.stream, self.group, *[message_id for message_id, _ in dead])
+            pipe.execute()
+            logger.error("moved %d events to %s", len(dead), self.dead_letter_stream)
+        return retry
+
+    def reclaim(self) -> int:
+        """Retry entries another consumer, or this one, failed to ack in time"""
+        response = redis_client.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=self.claim_idle_ms,
+            start_id=self._claim_cursor,
+            count=self.batch_size,
+        )
+        self._claim_cursor, messages = response[0], response[1]
+        return self._process(self._dead_letter(messages))
+
+    def read(self) -> int:
+        response = redis_client.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: ">"},
+            count=self.batch_size,
+            block=self.block_ms,
+        )
+        return sum(self._process(messages) for _, messages in response or [])
+
+    def run(self):
+        self.ensure_group()
+        while not self._stopped.is_set():
+            try:
+                self.reclaim()
+                self.read()
+            except Exception as e:
+                logger.warning("event consumer %s: %s", self.consumer, e)
+                self._stopped.wait(1)
+
+    def stop(self):
+        self._stopped.set()
+
+
+event_publisher = EventPublisher(
+    stream=settings.event_stream,
+    maxlen=settings.event_stream_maxlen,
+    batch_size=settings.event_publish_batch_size,
+    flush_interval=settings.event_publish_interval_seconds,
+    max_pending=settings.event_publish_max_pending,
+)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Url event stream")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    consume = subparsers.add_parser("consume", help="log every event as a group member")
+    consume.add_argument("--group", required=True)
+    consume.add_argument("--consumer", default=socket.gethostname())
+    info = subparsers.add_parser("info")
+    info.add_argument("--group")
+    args = parser.parse_args(argv)
+
+    if args.command == "consume":
+        handlers = {
+            event_type: lambda data, event_type=event_type: logger.info("%s %s", event_type, data)
+            for event_type in EVENT_TYPES
+        }
+        consumer = EventConsumer(args.group, args.consumer, handlers)
+        try:
+            consumer.run()
+        except KeyboardInterrupt:
+            consumer.stop()
+    else:
+        print({"length": redis_client.xlen(settings.event_stream)})
+        print({"dead_letters": redis_client.xlen(settings.event_dead_letter_stream)})
+        if args.group:
+            print(redis_client.xpending(settings.event_stream, args.group))
+
+
+if __name__ == "__main__":
+    main()
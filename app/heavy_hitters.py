@@ -0,0 +1,126 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Tuple
+
+from app.config import settings
+
+# rescale stored counts before the forward decay weights overflow a float
+MAX_WEIGHT = 2.0**60
+
+
+class SpaceSaving:
+    """Space-Saving top-k counter with exponential time decay.
+
+    At most `capacity` items are tracked; a new item evicts the current
+    minimum and inherits its count, which bounds the overestimate. Counts use
+    forward decay: each hit is weighted by 2 ** (age / half_life), so older
+    hits lose half their weight every `half_life` seconds without touching
+    the stored counters.
+    """
+
+    def __init__(self, capacity: int, half_life: float):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.counts: Dict[Hashable, float] = {}
+        # one entry per tracked item, possibly with a stale (lower) count
+        self._heap: List[Tuple[float, Hashable]] = []
+        self._landmark = time.monotonic()
+
+    def _weight(self, now: float) -> float:
+        return 2.0 ** ((now - self._landmark) / self.half_life)
+
+    def _rescale(self, now: float):
+        weight = self._weight(now)
+        self.counts = {item: count / weight for item, count in self.counts.items()}
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+        self._landmark = now
+
+    def _pop_min(self) -> Tuple[float, Hashable]:
+        while True:
+            count, item = heapq.heappop(self._heap)
+            current = self.counts[item]
+            if current == count:
+                return count, item
+            heapq.heappush(self._heap, (current, item))
+
+    def add(self, item: Hashable, count: int = 1):
+        now = time.monotonic()
+        weight = self._weight(now)
+        if weight > MAX_WEIGHT:
+            self._rescale(now)
+            weight = 1.0
+
+        if item in self.counts:
+            self.counts[item] += count * weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = count * weight
+        else:
+            floor, evicted = self._pop_min()
+            del self.counts[evicted]
+            self.counts[item] = floor + count * weight
+        heapq.heappush(self._heap, (self.counts[item], item))
+
+    def top(self, limit: int) -> List[Tuple[Hashable, float]]:
+        weight = self._weight(time.monotonic())
+        items = heapq.nlargest(limit, self.counts.items(), key=lambda entry: entry[1])
+        return [(item, count / weight) for item, count in items]
+
+
+class HeavyHitters:
+    """Per worker hot short codes and per url top referers over decayed windows"""
+
+    def __init__(
+        self,
+        windows: Dict[str, float],
+        capacity: int,
+        referer_capacity: int,
+        max_urls: int,
+    ):
+        self.windows = windows
+        self.referer_capacity = referer_capacity
+        self.max_urls = max_urls
+        self.hot_codes = {
+            name: SpaceSaving(capacity, half_life) for name, half_life in windows.items()
+        }
+        self._referers: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, url_id: int, short_code: str, referer: str):
+        with self._lock:
+            for tracker in self.hot_codes.values():
+                tracker.add(short_code)
+
+            trackers = self._referers.get(url_id)
+            if trackers is None:
+                trackers = {
+                    name: SpaceSaving(self.referer_capacity, half_life)
+                    for name, half_life in self.windows.items()
+                }
+                self._referers[url_id] = trackers
+                if len(self._referers) > self.max_urls:
+                    self._referers.popitem(last=False)
+            else:
+                self._referers.move_to_end(url_id)
+            for tracker in trackers.values():
+                tracker.add(referer)
+
+    def top_codes(self, window: str, limit: int) -> List[Tuple[str, float]]:
+        with self._lock:
+            return self.hot_codes[window].top(limit)
+
+    def top_referers(self, url_id: int, window: str, limit: int) -> List[Tuple[str, float]]:
+        with self._lock:
+            trackers = self._referers.get(url_id)
+            return trackers[window].top(limit) if trackers else []
+
+
+heavy_hitters = HeavyHitters(
+    windows=settings.heavy_hitters_windows,
+    capacity=settings.heavy_hitters_capacity,
+    referer_capacity=settings.heavy_hitters_referer_capacity,
+    max_urls=settings.heavy_hitters_max_urls,
+)
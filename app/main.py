@@ -1,17 +1,84 @@
-from fastapi import FastAPI, Request, HTTPException, status
+import asyncio
+
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 
+from app.analytics_partitions import analytics_partitions
+from app.auth_cache import handle_auth_invalidation
+from app.bloom_filter import short_code_filter
+from app.cache_warmup import cache_warmer
 from app.config import settings
-from app.database import create_db_and_tables
-from app.utils import get_rate_limit_key
-from app.redis_client import redis_service
+from app.database import async_engine, async_read_engine, create_db_and_tables
+from app.events import event_publisher
+from app.migrations import run_migrations
+from app.password_hashing import password_pool
+from app.rate_limiter import rate_limiter
+from app.redis_client import async_redis_service, redis_service
+from app.url_service import url_service, visit_buffer
+from app.utils import run_periodically
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    run_migrations()
+    if settings.bloom_filter_enabled:
+        await asyncio.to_thread(short_code_filter.rebuild_once)
+    if settings.cache_warmup_on_startup:
+        await asyncio.to_thread(cache_warmer.warm_once)
+    invalidation_listener = redis_service.subscribe(
+        settings.cache_invalidation_channel, url_service.handle_cache_invalidation
+    )
+    auth_invalidation_listener = redis_service.subscribe(
+        settings.auth_invalidation_channel, handle_auth_invalidation
+    )
+    await event_publisher.start()
+    await visit_buffer.start()
+    await rate_limiter.start()
+    prewarm_task = asyncio.create_task(
+        run_periodically(
+            settings.hot_urls_prewarm_interval_seconds,
+            url_service.prewarm_local_cache,
+        )
+    )
+    retention_task = asyncio.create_task(
+        run_periodically(
+            settings.analytics_retention_check_seconds,
+            lambda: asyncio.to_thread(analytics_partitions.enforce_retention),
+        )
+    )
+    expiry_task = asyncio.create_task(
+        run_periodically(
+            settings.expiry_sweep_interval_seconds,
+            lambda: asyncio.to_thread(url_service.deactivate_expired_urls),
+        )
+    )
+    bloom_retry_task = asyncio.create_task(
+        run_periodically(
+            settings.bloom_filter_retry_seconds,
+            lambda: asyncio.to_thread(short_code_filter.maintain),
+        )
+    )
     yield
+    bloom_retry_task.cancel()
+    expiry_task.cancel()
+    retention_task.cancel()
+    prewarm_task.cancel()
+    await rate_limiter.stop()
+    await visit_buffer.stop()
+    # after the visit buffer, its last flush can still publish events
+    await event_publisher.stop()
+    if invalidation_listener:
+        invalidation_listener.stop()
+    if auth_invalidation_listener:
+        auth_invalidation_listener.stop()
+    password_pool.shutdown()
+    await async_redis_service.close()
+    await async_engine.dispose()
+    if async_read_engine is not async_engine:
+        await async_read_engine.dispose()
 
 
 app = FastAPI(title="URL Shrotner App", debug=True, lifespan=lifespan)
@@ -32,20 +99,17 @@ async def root():
 
 @app.middleware("http")
 async def rate_limiter_middleware(request: Request, call_next):
-    rate_limit_key = get_rate_limit_key(request)
-    request_per_minute = settings.rate_limit_per_minute
-    current_count = redis_service.get_rate_limit(rate_limit_key)
+    result = await rate_limiter.hit(request)
 
-    if current_count >= request_per_minute:
-        raise HTTPException(
+    if not result.allowed:
+        return JSONResponse(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Rate limit exceeded. Please try again later.",
+            content={"detail": "Rate limit exceeded. Please try again later."},
+            headers=result.headers(),
         )
 
-    # increment and set rate limit
-    redis_service.set_rate_limit(rate_limit_key, 60)
-
     response = await call_next(request)
+    response.headers.update(result.headers())
     return response
 
 
@@ -0,0 +1,203 @@
+"""Versioned schema migrations for databases created before a model change.
+
+`create_db_and_tables` only creates missing tables, so indexes and columns
+added to existing tables are applied here. Every migration must be
+idempotent because a fresh database already has the current schema.
+
+Run against an existing database with:
+
+    DATABASE_URL=sqlite:///./url_shortener.db python -m app.migrations
+"""
+
+import argparse
+import sys
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Connection, delete, inspect, select, text
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlmodel import Session, SQLModel
+
+from app.database import engine
+from app.models import SchemaMigration, ShortURL, URLAnalytics
+from app.search import search_index
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def create_missing_indexes(model, *names: str) -> Callable[[Connection], None]:
+    """Create the named indexes of `model`.
+
+    Each migration lists its indexes explicitly, the live model may already
+    have indexes on columns that a later migration adds.
+    """
+
+    def apply(connection: Connection):
+        indexes = {index.name: index for index in model.__table__.indexes}
+        for name in names:
+            indexes[name].create(connection, checkfirst=True)
+
+    return apply
+
+
+def add_lookup_indexes(connection: Connection):
+    create_missing_indexes(ShortURL, "ix_shorturl_active_expires_at")(connection)
+    create_missing_indexes(
+        URLAnalytics,
+        "ix_urlanalytics_url_id_visited_at",
+        "ix_urlanalytics_visited_at",
+    )(connection)
+
+
+def move_legacy_analytics(connection: Connection):
+    """Move rows of the unpartitioned urlanalytics table into monthly partitions.
+
+    The rows are folded into the rollups and unique visitor counts on the
+    way, so analytics include the clicks recorded before partitioning.
+    """
+    from app.analytics import analytics_service
+    from app.analytics_partitions import analytics_partitions, visit_events
+
+    legacy = URLAnalytics.__table__
+    # joins the migration's transaction, the rollups commit with the move
+    session = Session(bind=connection)
+    while True:
+        rows = (
+            connection.execute(select(legacy).order_by(legacy.c.id).limit(10_000))
+            .mappings()
+            .all()
+        )
+        if not rows:
+            break
+        analytics_partitions.insert_rows(
+            connection, [dict(row) for row in rows], legacy=True
+        )
+        events = visit_events(rows)
+        analytics_service.record_visits(session, events)
+        analytics_service.record_unique_visitors(events)
+        connection.execute(delete(legacy).where(legacy.c.id <= rows[-1]["id"]))
+
+
+def replace_owner_listing_index(connection: Connection):
+    connection.execute(text("DROP INDEX IF EXISTS ix_shorturl_owner_id_created_at"))
+    create_missing_indexes(ShortURL, "ix_shorturl_owner_id_created_at_id")(connection)
+
+
+def add_missing_columns(model, *names: str) -> Callable[[Connection], None]:
+    def apply(connection: Connection):
+        table = model.__table__
+        existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+        for name in names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}")
+            )
+
+    return apply
+
+
+def add_url_hash(connection: Connection):
+    add_missing_columns(ShortURL, "url_hash")(connection)
+    create_missing_indexes(ShortURL, "ix_shorturl_url_hash")(connection)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1,
+        "shorturl and urlanalytics lookup indexes",
+        add_lookup_indexes,
+    ),
+    Migration(
+        2,
+        "move urlanalytics rows into monthly partitions",
+        move_legacy_analytics,
+    ),
+    Migration(
+        3,
+        "keyset pagination index on shorturl (owner_id, created_at, id)",
+        replace_owner_listing_index,
+    ),
+    Migration(
+        4,
+        "full text search index over shorturl",
+        lambda connection: search_index.setup(connection),
+    ),
+    Migration(5, "shorturl.url_hash dedup column", add_url_hash),
+    Migration(
+        6,
+        "drop partial short_code index shadowed by the unique index",
+        lambda connection: connection.execute(
+            text("DROP INDEX IF EXISTS ix_shorturl_active_short_code")
+        ),
+    ),
+]
+
+
+def run_migrations(bind=engine) -> List[Migration]:
+    """Apply pending migrations in order, each in its own transaction.
+
+    Every worker runs this on startup. A migration's version row is inserted
+    before it is applied, in the same transaction, so a worker racing for the
+    same version waits on the row lock and then skips it once the winner has
+    committed.
+    """
+    table = SchemaMigration.__table__
+    try:
+        table.create(bind, checkfirst=True)
+    except DBAPIError:
+        # another worker created it between the check and the CREATE
+        if not inspect(bind).has_table(table.name):
+            raise
+    with bind.connect() as connection:
+        applied = set(connection.execute(select(table.c.version)).scalars())
+
+    pending = [migration for migration in MIGRATIONS if migration.version not in applied]
+    applied_here = []
+    for migration in pending:
+        with bind.connect() as connection, connection.begin() as transaction:
+            try:
+                connection.execute(
+                    table.insert().values(
+                        version=migration.version, description=migration.description
+                    )
+                )
+            except IntegrityError:
+                # another worker applied this version first
+                transaction.rollback()
+                continue
+            migration.apply(connection)
+        applied_here.append(migration)
+    return applied_here
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument(
+        "--check-plans",
+        action="store_true",
+        help="fail if a hot query is planned as a full table scan",
+    )
+    args = parser.parse_args(argv)
+
+    SQLModel.metadata.create_all(engine)
+    for migration in run_migrations():
+        print(f"applied {migration.version}: {migration.description}")
+
+    if args.check_plans:
+        from app.query_plans import check_query_plans
+
+        problems = check_query_plans()
+        for name, plan in problems.items():
+            print(f"{name} is not using an index:\n  " + "\n  ".join(plan))
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from enum import Enum
 from pydantic import EmailStr
 
@@ -17,7 +18,7 @@ class User(SQLModel, table=True):
     hashed_password: str
     role: UserRole = Field(default=UserRole.USER)
     is_active: bool = Field(default=True)
-    created_at: datetime = Field(default_factory=datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     # Relationships
     urls: List["ShortURL"] = Relationship(back_populates="owner")
@@ -25,6 +26,16 @@ class User(SQLModel, table=True):
 
 
 class ShortURL(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_shorturl_owner_id_created_at_id", "owner_id", "created_at", "id"),
+        Index(
+            "ix_shorturl_active_expires_at",
+            "expires_at",
+            sqlite_where=text("is_active = 1"),
+            postgresql_where=text("is_active"),
+        ),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     short_code: str = Field(unique=True)
     original_url: str
@@ -33,10 +44,12 @@ class ShortURL(SQLModel, table=True):
     description: Optional[str] = None
 
     is_active: bool = Field(default=True)
-    created_at: datetime = Field(default_factory=datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     expires_at: Optional[datetime] = Field(default=None)
     visit_count: int = Field(default=0)
     last_visited: Optional[datetime] = Field(default=None)
+    # sha256 of owner and normalized url, see URLService.get_url_hash
+    url_hash: Optional[str] = Field(default=None, index=True)
 
     owner_id: int = Field(foreign_key="user.id")
 
@@ -45,14 +58,30 @@ class ShortURL(SQLModel, table=True):
     analytics: List["URLAnalytics"] = Relationship(back_populates="url")
 
 
+class ShortCodeSequence(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    next_value: int = Field(default=0)
+
+
+class ShortCodeKey(SQLModel, table=True):
+    # generated permutation key, used when short_code_secret is not configured
+    name: str = Field(primary_key=True)
+    secret: str
+
+
 class URLAnalytics(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_urlanalytics_url_id_visited_at", "url_id", "visited_at"),
+        Index("ix_urlanalytics_visited_at", "visited_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     ip_address: Optional[str] = None
     user_agent: Optional[str] = None
     referer: Optional[str] = None
     country: Optional[str] = None
     city: Optional[str] = None
-    visited_at: datetime = Field(default_factory=datetime.now(timezone.utc))
+    visited_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     url_id: int = Field(foreign_key="shorturl.id")
     user_id: int = Field(foreign_key="user.id")
@@ -62,6 +91,42 @@ class URLAnalytics(SQLModel, table=True):
     url: ShortURL = Relationship(back_populates="analytics")
 
 
+class SchemaMigration(SQLModel, table=True):
+    version: int = Field(primary_key=True)
+    description: str
+    applied_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class AnalyticsPartition(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    month: date = Field(index=True)
+    rolled_up: bool = Field(default=True)
+
+
+class URLDailyStats(SQLModel, table=True):
+    url_id: int = Field(foreign_key="shorturl.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    visits: int = Field(default=0)
+
+
+class URLHourlyStats(SQLModel, table=True):
+    url_id: int = Field(foreign_key="shorturl.id", primary_key=True)
+    hour: datetime = Field(primary_key=True)
+    visits: int = Field(default=0)
+
+
+class URLCountryStats(SQLModel, table=True):
+    url_id: int = Field(foreign_key="shorturl.id", primary_key=True)
+    country: str = Field(primary_key=True)
+    visits: int = Field(default=0)
+
+
+class URLRefererStats(SQLModel, table=True):
+    url_id: int = Field(foreign_key="shorturl.id", primary_key=True)
+    referer: str = Field(primary_key=True)
+    visits: int = Field(default=0)
+
+
 class UserCreate(SQLModel):
     username: str
     email: str
@@ -92,6 +157,8 @@ class URLCreate(SQLModel):
     title: Optional[str] = None
     description: Optional[str] = None
     expires_in_days: Optional[int] = None
+    # return an existing link for the same destination, defaults to settings.url_dedup_enabled
+    dedupe: Optional[bool] = None
 
 
 class URLResponse(SQLModel):
@@ -108,11 +175,76 @@ class URLResponse(SQLModel):
     last_visited: Optional[datetime]
 
 
+class URLStatus(str, Enum):
+    ALL = "all"
+    ACTIVE = "active"
+    EXPIRED = "expired"
+
+
+class URLListItem(SQLModel):
+    id: int
+    short_code: str
+    short_url: str
+    original_url: str
+    title: Optional[str]
+    is_active: bool
+    created_at: datetime
+    expires_at: Optional[datetime]
+    visit_count: int
+
+
+class URLListResponse(SQLModel):
+    items: List[URLListItem]
+    next_cursor: Optional[str]
+    total_count: int
+    active_count: int
+
+
+class URLSearchItem(URLListItem):
+    rank: float
+
+
+class URLSearchResponse(SQLModel):
+    items: List[URLSearchItem]
+    limit: int
+    offset: int
+
+
+class URLBulkItemResult(SQLModel):
+    index: int
+    success: bool
+    url: Optional[URLResponse] = None
+    error: Optional[str] = None
+
+
+class URLBulkCreateResponse(SQLModel):
+    created: int
+    failed: int
+    results: List[URLBulkItemResult]
+
+
+class HeavyHitter(SQLModel):
+    value: str
+    score: float
+
+
+class HeavyHittersResponse(SQLModel):
+    # sketches are kept in process memory, so counts only cover the worker
+    # that served the request, not the whole deployment
+    scope: str = "worker"
+    worker_pid: int
+    items: List[HeavyHitter]
+
+
 class URLAnalyticsResponse(SQLModel):
     total_visits: int
     unique_visitors: int
-    visits_by_country: dict
+    # no geo lookup is wired in yet, so every visit is counted as "unknown"
+    visits_by_country: dict = Field(
+        description='Visits per country; always {"unknown": N} until geo lookup exists'
+    )
     visits_by_date: dict
+    visits_by_hour: dict = {}
     top_referers: List[dict]
 
 
@@ -0,0 +1,69 @@
+"""Runs password hashing and verification off the event loop.
+
+Argon2 costs tens of milliseconds of CPU per call. argon2-cffi releases
+the GIL while hashing, so a small thread pool keeps that work from
+stalling redirects served by the same worker. Admission is capped: once
+`max_pending` calls are queued or running, new ones fail fast with a 503
+instead of piling up behind a login storm.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+from app.config import settings
+
+password_hash = PasswordHash(
+    (
+        Argon2Hasher(
+            time_cost=settings.password_hash_time_cost,
+            memory_cost=settings.password_hash_memory_cost_kib,
+            parallelism=settings.password_hash_parallelism,
+        ),
+    )
+)
+
+
+class PasswordHashingPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hash"
+        )
+
+    async def _run(self, func: Callable, *args):
+        # only touched from the event loop, so a plain counter is enough
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry shortly.",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(password_hash.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Check a password, also returning a new hash if the stored one uses outdated parameters"""
+        return await self._run(password_hash.verify_and_update, password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_pool = PasswordHashingPool(
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
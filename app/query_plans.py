@@ -0,0 +1,75 @@
+"""EXPLAIN based guard that keeps the hot queries on index scans.
+
+    python -m app.query_plans
+"""
+
+import re
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from sqlalchemy import Select, select, text, true
+
+from app.analytics_partitions import analytics_partitions
+from app.database import engine
+from app.models import ShortURL, URLAnalytics
+
+SQLITE_FULL_SCAN = re.compile(r"^SCAN \w+$")
+
+
+def hot_queries(connection) -> Dict[str, Select]:
+    since = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    partitions = analytics_partitions.tables_for_range(connection)
+    # the newest partition is the one taking writes, fall back to the template table
+    analytics = partitions[-1] if partitions else URLAnalytics.__table__
+    return {
+        "redirect": select(ShortURL).where(
+            ShortURL.short_code == "abc1234", ShortURL.is_active == true()
+        ),
+        "owner_listing": select(ShortURL)
+        .where(ShortURL.owner_id == 1)
+        .order_by(ShortURL.created_at.desc(), ShortURL.id.desc())
+        .limit(50),
+        "analytics_range": select(analytics).where(
+            analytics.c.url_id == 1, analytics.c.visited_at >= since
+        ),
+    }
+
+
+def explain(connection, statement: Select) -> List[str]:
+    sql = str(
+        statement.compile(
+            dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+        )
+    )
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+        return [row[-1] for row in rows]
+    return [row[0] for row in connection.execute(text(f"EXPLAIN {sql}")).all()]
+
+
+def is_full_scan(dialect: str, plan: List[str]) -> bool:
+    if dialect == "sqlite":
+        return any(SQLITE_FULL_SCAN.match(line) for line in plan)
+    return any("Seq Scan" in line for line in plan)
+
+
+def check_query_plans(bind=engine) -> Dict[str, List[str]]:
+    """Plans of the hot queries that would scan a whole table"""
+    problems = {}
+    with bind.connect() as connection:
+        if connection.dialect.name == "postgresql":
+            # small tables are always cheaper to scan, only ask whether an index is usable
+            connection.execute(text("SET enable_seqscan = off"))
+        for name, statement in hot_queries(connection).items():
+            plan = explain(connection, statement)
+            if is_full_scan(connection.dialect.name, plan):
+                problems[name] = plan
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check_query_plans()
+    for name, plan in problems.items():
+        print(f"{name} is not using an index:\n  " + "\n  ".join(plan))
+    sys.exit(1 if problems else 0)
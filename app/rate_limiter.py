@@ -0,0 +1,280 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, defaultdict
+from typing import NamedTuple, Optional
+
+from fastapi import Request
+from jwt.exceptions import InvalidTokenError
+
+from app.auth_cache import decode_token
+from app.circuit_breaker import CircuitBreaker
+from app.config import settings
+from app.redis_client import async_redis_client
+from app.utils import get_rate_limit_key
+
+WINDOW_MS = 60_000
+
+# KEYS[1] current window counter, KEYS[2] previous window counter
+# ARGV limit, window length (ms), now (ms)
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local elapsed = now % window
+local used = math.floor(previous * (window - elapsed) / window) + current
+if used >= limit then
+    return {0, 0, window - elapsed}
+end
+redis.call('INCR', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], window * 2)
+return {1, limit - used - 1, window - elapsed}
+"""
+
+# KEYS[1] bucket hash
+# ARGV capacity, refill rate (tokens per ms), now (ms)
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+local wait = 0
+if allowed == 0 then
+    wait = math.ceil((1 - tokens) / rate)
+else
+    wait = math.ceil((capacity - tokens) / rate)
+end
+return {allowed, math.floor(tokens), wait}
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: int
+
+    def headers(self) -> dict:
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(max(self.remaining, 0)),
+            "RateLimit-Reset": str(self.reset_after),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.reset_after)
+        return headers
+
+
+class LocalTokenBucket:
+    """Per worker token buckets, one per rate limit key, refilled at limit per minute"""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+
+    def hit(self, key: str, limit: int) -> RateLimitResult:
+        now = time.monotonic()
+        rate = limit / (WINDOW_MS / 1000)
+        tokens, updated_at = self._buckets.get(key, (limit, now))
+        tokens = min(limit, tokens + (now - updated_at) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        wait = (limit - tokens) / rate if allowed else (1 - tokens) / rate
+        return RateLimitResult(
+            allowed=allowed,
+            limit=limit,
+            remaining=int(tokens),
+            reset_after=math.ceil(wait),
+        )
+
+
+class RateLimiter:
+    """Rate limits requests per user or client IP.
+
+    In "hybrid" mode every decision is made in process: a local token bucket
+    bounds bursts and the last known cluster wide count for the current
+    minute (refreshed by a background sync that pushes this worker's hits to
+    redis) bounds the total. In "redis" mode each request runs one atomic
+    script. Either way a circuit breaker stops talking to redis while it is
+    failing and the local buckets keep enforcing limits.
+    """
+
+    def __init__(self, mode: str, algorithm: str):
+        self.mode = mode
+        self.algorithm = algorithm
+        self.sliding_window = async_redis_client.register_script(SLIDING_WINDOW_SCRIPT)
+        self.token_bucket = async_redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.local = LocalTokenBucket(settings.rate_limit_local_max_keys)
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.redis_circuit_failure_threshold,
+            reset_timeout=settings.redis_circuit_reset_seconds,
+        )
+        # (key, minute) -> hits not yet pushed to redis / last cluster wide count
+        self._pending: defaultdict = defaultdict(int)
+        self._global_counts: dict = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def get_user_id(self, request: Request) -> Optional[str]:
+        authorization = request.headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            payload = decode_token(token)
+        except InvalidTokenError:
+            return None
+        return payload.get("user_id") or payload.get("sub")
+
+    def get_route_limit(self, path: str) -> tuple[Optional[str], Optional[int]]:
+        matches = [prefix for prefix in settings.rate_limit_routes if path.startswith(prefix)]
+        if not matches:
+            return None, None
+        prefix = max(matches, key=len)
+        return prefix, settings.rate_limit_routes[prefix]
+
+    def resolve(self, request: Request) -> tuple[str, int]:
+        """Rate limit key and per minute limit for a request"""
+        user_id = self.get_user_id(request)
+        scope, limit = self.get_route_limit(request.url.path)
+        if limit is None:
+            scope = "global"
+            limit = (
+                settings.rate_limit_authenticated_per_minute
+                if user_id is not None
+                else settings.rate_limit_per_minute
+            )
+        return get_rate_limit_key(request, user_id=user_id, scope=scope), limit
+
+    async def hit(self, request: Request) -> RateLimitResult:
+        key, limit = self.resolve(request)
+        if self.mode == "hybrid":
+            return self.hit_hybrid(key, limit)
+        if not self.breaker.allow_request():
+            return self.local.hit(key, limit)
+        try:
+            result = await self.hit_redis(key, limit)
+        except Exception as e:
+            self.breaker.record_failure()
+            return self.local.hit(key, limit)
+        self.breaker.record_success()
+        return result
+
+    async def hit_redis(self, key: str, limit: int) -> RateLimitResult:
+        now = int(time.time() * 1000)
+        if self.algorithm == "token_bucket":
+            allowed, remaining, wait_ms = await self.token_bucket(
+                keys=[key], args=[limit, limit / WINDOW_MS, now]
+            )
+        else:
+            window = now // WINDOW_MS
+            allowed, remaining, wait_ms = await self.sliding_window(
+                keys=[f"{key}:{window}", f"{key}:{window - 1}"],
+                args=[limit, WINDOW_MS, now],
+            )
+        return RateLimitResult(
+            allowed=bool(allowed),
+            limit=limit,
+            remaining=int(remaining),
+            reset_after=math.ceil(int(wait_ms) / 1000),
+        )
+
+    def hit_hybrid(self, key: str, limit: int) -> RateLimitResult:
+        result = self.local.hit(key, limit)
+        if not result.allowed:
+            return result
+
+        now = int(time.time() * 1000)
+        window_key = (key, now // WINDOW_MS)
+        used = self._global_counts.get(window_key, 0) + self._pending.get(window_key, 0)
+        if used >= limit:
+            return RateLimitResult(
+                allowed=False,
+                limit=limit,
+                remaining=0,
+                reset_after=math.ceil((WINDOW_MS - now % WINDOW_MS) / 1000),
+            )
+        self._pending[window_key] += 1
+        return result._replace(remaining=min(result.remaining, limit - used - 1))
+
+    def _prune_pending(self):
+        """Forget hits for windows redis no longer counts, and cap the tracked keys"""
+        oldest_window = int(time.time() * 1000) // WINDOW_MS - 1
+        pending = defaultdict(int)
+        for window_key, count in self._pending.items():
+            if window_key[1] >= oldest_window:
+                pending[window_key] = count
+        # oldest insertions go first, the local buckets still bound each client
+        excess = len(pending) - settings.rate_limit_local_max_keys
+        for window_key in list(pending)[: max(excess, 0)]:
+            del pending[window_key]
+        self._pending = pending
+
+    async def sync(self):
+        """Push this worker's hits to redis and pull back the cluster wide counts"""
+        # runs even while redis is unreachable so an outage cannot grow it
+        self._prune_pending()
+        if not self._pending or not self.breaker.allow_request():
+            return
+        pending, self._pending = self._pending, defaultdict(int)
+        try:
+            pipe = async_redis_client.pipeline(transaction=False)
+            for (key, window), count in pending.items():
+                pipe.incrby(f"{key}:{window}", count)
+                pipe.pexpire(f"{key}:{window}", WINDOW_MS * 2)
+            results = await pipe.execute()
+        except Exception as e:
+            self.breaker.record_failure()
+            for window_key, count in pending.items():
+                self._pending[window_key] += count
+            self._prune_pending()
+            return
+        self.breaker.record_success()
+
+        current_window = int(time.time() * 1000) // WINDOW_MS
+        self._global_counts = {
+            window_key: count
+            for window_key, count in self._global_counts.items()
+            if window_key[1] >= current_window
+        }
+        for window_key, count in zip(pending, results[::2]):
+            if window_key[1] >= current_window:
+                self._global_counts[window_key] = count
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.rate_limit_sync_interval_seconds)
+            await self.sync()
+
+    async def start(self):
+        if self.mode == "hybrid":
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.sync()
+
+
+rate_limiter = RateLimiter(settings.rate_limit_mode, settings.rate_limit_algorithm)
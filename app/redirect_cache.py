@@ -0,0 +1,180 @@
+"""Redirect cache entries and stampede protection.
+
+Entries are packed into a short delimited string holding only what a
+redirect needs (id, owner, expiry, target) plus the soft expiry fields, and
+are decoded into a `RedirectEntry` tuple instead of a full ShortURL model.
+
+Entries carry a soft expiry (`_fresh_until`) inside a longer redis TTL.
+Past the soft expiry an entry is still served while one background task
+refreshes it; before it, XFetch style probabilistic early refresh makes it
+likely a single request refreshes a hot key first. Misses are coalesced per
+key within a worker (single flight) and across workers with a short redis
+lock, so an expiring viral link costs one database query instead of one
+per concurrent request.
+"""
+
+import asyncio
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+from app.config import settings
+from app.redis_client import async_redis_client, async_redis_service
+from app.utils import as_utc
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+release_lock_script = async_redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+# deactivation leaves a gone tombstone, a replica that has not seen the
+# update yet must not put the active entry back
+SET_UNLESS_GONE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[2] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+set_unless_gone_script = async_redis_client.register_script(SET_UNLESS_GONE_SCRIPT)
+
+LOCK_POLL_SECONDS = 0.05
+
+# negative entries, a code that never existed and one that expired or was deactivated
+MISSING = "-"
+GONE = "!"
+
+
+class RedirectEntry(NamedTuple):
+    id: Optional[int]
+    owner_id: Optional[int]
+    short_code: str
+    original_url: Optional[str]
+    is_active: bool
+    expires_at: Optional[datetime]
+    fresh_until: Optional[float] = None
+    delta: float = 0.0
+
+
+def get_lock_key(cache_key: str):
+    return f"lock:{cache_key}"
+
+
+def encode_entry(url, delta: float = 0.0) -> str:
+    """Pack an active url with its soft expiry and how long it took to load"""
+    expires_at = int(as_utc(url.expires_at).timestamp()) if url.expires_at else ""
+    fresh_until = int(time.time() + settings.default_cache_expiry_seconds)
+    # the target goes last so it may contain the separator
+    return f"{url.id}|{url.owner_id}|{expires_at}|{fresh_until}|{delta:.3f}|{url.original_url}"
+
+
+def decode_entry(short_code: str, raw: Optional[str]) -> Optional[RedirectEntry]:
+    """Unpack a cached value, None for a missing code or anything unreadable"""
+    if not raw or raw == MISSING:
+        return None
+    if raw == GONE:
+        return RedirectEntry(None, None, short_code, None, False, None)
+    try:
+        url_id, owner_id, expires_at, fresh_until, delta, original_url = raw.split("|", 5)
+        return RedirectEntry(
+            id=int(url_id),
+            owner_id=int(owner_id),
+            short_code=short_code,
+            original_url=original_url,
+            is_active=True,
+            expires_at=(
+                datetime.fromtimestamp(int(expires_at), timezone.utc)
+                if expires_at
+                else None
+            ),
+            fresh_until=float(fresh_until),
+            delta=float(delta),
+        )
+    except ValueError:
+        return None
+
+
+def needs_refresh(entry: RedirectEntry) -> bool:
+    fresh_until = entry.fresh_until
+    if fresh_until is None:
+        return False
+    delta = entry.delta
+    # -log(random()) is exponentially distributed, so the chance of an early
+    # refresh grows as the soft expiry approaches and with recompute cost
+    jitter = -delta * settings.cache_early_refresh_beta * math.log(1.0 - random.random())
+    return time.time() + jitter >= fresh_until
+
+
+class SingleFlight:
+    """Runs at most one coroutine per key at a time, concurrent callers share its result"""
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Task] = {}
+
+    def _start(self, key: str, func: Callable[[], Awaitable]) -> asyncio.Task:
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.create_task(func())
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        return task
+
+    async def do(self, key: str, func: Callable[[], Awaitable]):
+        # shielded so a cancelled caller does not cancel the shared load
+        return await asyncio.shield(self._start(key, func))
+
+    def spawn(self, key: str, func: Callable[[], Awaitable]):
+        self._start(key, func)
+
+
+async def acquire_lock(cache_key: str) -> Optional[str]:
+    token = uuid.uuid4().hex
+    try:
+        acquired = await async_redis_client.set(
+            get_lock_key(cache_key), token, nx=True, px=settings.cache_lock_ms
+        )
+    except Exception as e:
+        # without redis there is nobody to coordinate with
+        return token
+    return token if acquired else None
+
+
+async def release_lock(cache_key: str, token: str):
+    try:
+        await release_lock_script(keys=[get_lock_key(cache_key)], args=[token])
+    except Exception as e:
+        pass
+
+
+async def set_active_entry(cache_key: str, cached: str, expire: int) -> Optional[bool]:
+    """Store an active entry unless a gone tombstone is in the way.
+
+    True when stored, False when the tombstone was kept and None when redis
+    could not be reached, so callers can tell a deactivation from an outage.
+    """
+    try:
+        return bool(
+            await set_unless_gone_script(keys=[cache_key], args=[cached, GONE, expire])
+        )
+    except Exception as e:
+        return None
+
+
+async def wait_for_cache(cache_key: str) -> Optional[str]:
+    """Poll redis while another worker holds the lock and fills the key"""
+    deadline = time.monotonic() + settings.cache_lock_wait_ms / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LOCK_POLL_SECONDS)
+        cached = await async_redis_service.get_string(cache_key)
+        if cached:
+            return cached
+    return None
+
+
+redirect_flights = SingleFlight()
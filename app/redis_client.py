@@ -1,16 +1,205 @@
 import redis
+import redis.asyncio as aioredis
 from redis import Redis
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.asyncio.sentinel import Sentinel as AsyncSentinel
+from redis.cluster import RedisCluster
+from redis.connection import parse_url
+from redis.sentinel import Sentinel
 import json
-from typing import Optional, Any
+import time
+from typing import Optional, Any, Callable, List
 
 from app.config import settings
 
-redis_client: Redis = redis.from_url(settings.redis_url, decode_responses=True)
+
+def get_sentinel_hosts() -> list:
+    hosts = []
+    for sentinel in settings.redis_sentinels:
+        host, _, port = sentinel.rpartition(":")
+        hosts.append((host, int(port)))
+    return hosts
+
+
+def get_master_options() -> dict:
+    url = parse_url(settings.redis_url)
+    return {key: url[key] for key in ("db", "username", "password") if key in url}
+
+
+def create_redis_client() -> Redis:
+    options = {
+        "decode_responses": True,
+        "max_connections": settings.redis_sync_max_connections,
+        "socket_timeout": settings.redis_sync_socket_timeout,
+        "socket_connect_timeout": settings.redis_sync_socket_timeout,
+        "health_check_interval": settings.redis_health_check_interval,
+    }
+    if settings.redis_mode == "cluster":
+        return RedisCluster.from_url(settings.redis_url, **options)
+    if settings.redis_mode == "sentinel":
+        sentinel = Sentinel(
+            get_sentinel_hosts(), socket_timeout=settings.redis_sync_socket_timeout
+        )
+        return sentinel.master_for(
+            settings.redis_sentinel_service, **options, **get_master_options()
+        )
+    return Redis(connection_pool=redis.ConnectionPool.from_url(settings.redis_url, **options))
+
+
+def create_async_redis_client() -> aioredis.Redis:
+    options = {
+        "decode_responses": True,
+        "max_connections": settings.redis_max_connections,
+        "socket_timeout": settings.redis_socket_timeout,
+        "socket_connect_timeout": settings.redis_socket_timeout,
+        "health_check_interval": settings.redis_health_check_interval,
+    }
+    if settings.redis_mode == "cluster":
+        return AsyncRedisCluster.from_url(settings.redis_url, **options)
+    if settings.redis_mode == "sentinel":
+        sentinel = AsyncSentinel(
+            get_sentinel_hosts(), socket_timeout=settings.redis_socket_timeout
+        )
+        return sentinel.master_for(
+            settings.redis_sentinel_service, **options, **get_master_options()
+        )
+    return aioredis.Redis(
+        connection_pool=aioredis.ConnectionPool.from_url(settings.redis_url, **options)
+    )
+
+
+redis_client: Redis = create_redis_client()
+async_redis_client: aioredis.Redis = create_async_redis_client()
+
+# only touch counters that were initialised, a partial hash would read as a real count
+HINCRBY_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+
+def decode_json(value):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+class BatchResult:
+    """Value of one batched operation, filled in when the batch executes"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any = None):
+        self.value = value
+
+
+class RedisBatch:
+    """Queue RedisService operations on one pipeline and send them in a single round trip.
+
+    Methods mirror the RedisService ones and return a BatchResult. If a command
+    or the whole pipeline fails, the result keeps the fallback the service
+    method would have returned.
+    """
+
+    def __init__(self, client):
+        self._pipe = client.pipeline(transaction=False)
+        # (number of commands, decoder, result) per queued operation
+        self._queued: List[tuple] = []
+
+    def _queue(self, commands: int, decode: Callable, fallback: Any) -> BatchResult:
+        result = BatchResult(fallback)
+        self._queued.append((commands, decode, result))
+        return result
+
+    def set_cache(
+        self,
+        key: str,
+        value: Any,
+        expire: Optional[int] = settings.default_cache_expiry_seconds,
+    ) -> BatchResult:
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        self._pipe.set(key, value, expire)
+        return self._queue(1, bool, False)
+
+    def get_cache(self, key: str) -> BatchResult:
+        self._pipe.get(key)
+        return self._queue(1, decode_json, None)
+
+    def get_string(self, key: str) -> BatchResult:
+        self._pipe.get(key)
+        return self._queue(1, lambda value: value, None)
+
+    def delete_cache(self, key: str) -> BatchResult:
+        self._pipe.delete(key)
+        return self._queue(1, bool, False)
+
+    def increment_counter(self, key: str, amount: int = 1) -> BatchResult:
+        self._pipe.incrby(key, amount)
+        return self._queue(1, int, 0)
+
+    def increment_counters(self, key: str, amounts: dict) -> BatchResult:
+        args = [item for pair in amounts.items() for item in pair]
+        # plain EVAL, registered scripts are sync or async depending on the client
+        self._pipe.eval(HINCRBY_IF_EXISTS_SCRIPT, 1, key, *args)
+        return self._queue(1, bool, False)
+
+    def publish_message(self, channel: str, message: dict) -> BatchResult:
+        self._pipe.publish(channel, json.dumps(message))
+        return self._queue(1, int, 0)
+
+    def get_rate_limit(self, key: str) -> BatchResult:
+        self._pipe.get(key)
+        return self._queue(1, lambda count: int(count) if count else 0, 0)
+
+    def set_rate_limit(self, key: str, seconds: int) -> BatchResult:
+        self._pipe.incr(key)
+        self._pipe.expire(key, seconds)
+        return self._queue(2, lambda values: True, False)
+
+    def _resolve(self, values: list):
+        position = 0
+        for commands, decode, result in self._queued:
+            chunk = values[position : position + commands]
+            position += commands
+            if any(isinstance(value, Exception) for value in chunk):
+                continue
+            result.value = decode(chunk[0] if commands == 1 else chunk)
+        self._queued = []
+
+    def execute(self):
+        if not self._queued:
+            return
+        try:
+            values = self._pipe.execute(raise_on_error=False)
+        except Exception as e:
+            self._queued = []
+            return
+        self._resolve(values)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
 
 
 class RedisService:
     def __init__(self):
         self.client = redis_client
+        self.hincrby_if_exists = self.client.register_script(HINCRBY_IF_EXISTS_SCRIPT)
+
+    def batch(self) -> RedisBatch:
+        return RedisBatch(self.client)
 
     def set_cache(
         self,
@@ -49,6 +238,31 @@ class RedisService:
         except Exception as e:
             return 0
 
+    def get_counters(self, key: str) -> dict:
+        try:
+            return {field: int(value) for field, value in self.client.hgetall(key).items()}
+        except Exception as e:
+            return {}
+
+    def set_counters(self, key: str, counters: dict, expire: Optional[int] = None) -> bool:
+        try:
+            pipe = self.client.pipeline()
+            pipe.hset(key, mapping=counters)
+            if expire:
+                pipe.expire(key, expire)
+            pipe.execute()
+            return True
+        except Exception as e:
+            return False
+
+    def increment_counters(self, key: str, amounts: dict) -> bool:
+        """HINCRBY each field of an existing counter hash, no-op if it is not cached"""
+        try:
+            args = [item for pair in amounts.items() for item in pair]
+            return bool(self.hincrby_if_exists(keys=[key], args=args))
+        except Exception as e:
+            return False
+
     def set_expire(self, key: str, seconds: int) -> bool:
         try:
             return self.client.expire(key, seconds)
@@ -61,6 +275,45 @@ class RedisService:
         except Exception as e:
             return False
 
+    def add_to_hyperloglogs(self, values: dict) -> bool:
+        """PFADD each list of values in `values` to its key in one pipeline"""
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, members in values.items():
+                pipe.pfadd(key, *members)
+            pipe.execute()
+            return True
+        except Exception as e:
+            return False
+
+    def count_hyperloglog(self, key: str) -> int:
+        try:
+            return self.client.pfcount(key)
+        except Exception as e:
+            return 0
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        """Run `handler` with the decoded payload of every message on `channel` in a background thread"""
+
+        def on_message(message):
+            try:
+                handler(json.loads(message["data"]))
+            except (json.JSONDecodeError, TypeError):
+                pass
+
+        def on_error(exc, pubsub, thread):
+            # keep the listener alive across redis restarts
+            time.sleep(1)
+
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: on_message})
+            return pubsub.run_in_thread(
+                sleep_time=1, daemon=True, exception_handler=on_error
+            )
+        except Exception as e:
+            return None
+
     def get_rate_limit(self, key: str) -> int:
         try:
             count = self.client.get(key)
@@ -79,4 +332,71 @@ class RedisService:
             return False
 
 
+class AsyncRedisService:
+    """asyncio counterpart of RedisService for code running on the event loop"""
+
+    def __init__(self):
+        self.client = async_redis_client
+
+    async def set_cache(
+        self,
+        key: str,
+        value: Any,
+        expire: Optional[int] = settings.default_cache_expiry_seconds,
+    ) -> bool:
+        try:
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value)
+            return await self.client.set(key, value, expire)
+        except Exception as e:
+            return False
+
+    async def get_cache(self, key: str) -> Optional[Any]:
+        try:
+            value = await self.client.get(key)
+            if value:
+                try:
+                    return json.loads(value)
+                except json.JSONDecodeError:
+                    return value
+            return None
+        except Exception as e:
+            return False
+
+    async def get_string(self, key: str) -> Optional[str]:
+        try:
+            return await self.client.get(key)
+        except Exception as e:
+            return None
+
+    async def get_strings(self, keys: list) -> list:
+        # one GET per key instead of MGET, in cluster mode the keys span slots
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+            return await pipe.execute()
+        except Exception as e:
+            return [None] * len(keys)
+
+    async def delete_cache(self, key: str) -> bool:
+        try:
+            return bool(await self.client.delete(key))
+        except Exception as e:
+            return False
+
+    async def publish_message(self, channel: str, message: dict) -> bool:
+        try:
+            return await self.client.publish(channel, json.dumps(message))
+        except Exception as e:
+            return False
+
+    async def close(self):
+        if isinstance(self.client, AsyncRedisCluster):
+            await self.client.close()
+        else:
+            await self.client.connection_pool.disconnect()
+
+
 redis_service = RedisService()
+async_redis_service = AsyncRedisService()
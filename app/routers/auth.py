@@ -3,8 +3,8 @@ from sqlmodel import Session, select
 
 from app.models import User, UserResponse, UserCreate, Token, UserLogin
 from app.database import get_session
+from app.password_hashing import password_pool
 from app.auth import (
-    get_password_hash,
     authenticate_user,
     create_access_token,
     refresh_access_token,
@@ -30,7 +30,7 @@ async def register(user_data: UserCreate, session: Session = Depends(get_session
             status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered"
         )
 
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await password_pool.hash(user_data.password)
     user = User(
         username=user_data.username,
         email=user_data.email,
@@ -39,11 +39,11 @@ async def register(user_data: UserCreate, session: Session = Depends(get_session
 
     session.add(user)
     session.commit()
-    session.refresh()
+    session.refresh(user)
 
     return UserResponse(
         id=user.id,
-        username=user.usernamae,
+        username=user.username,
         email=user.email,
         role=user.role,
         is_active=user.is_active,
@@ -53,7 +53,7 @@ async def register(user_data: UserCreate, session: Session = Depends(get_session
 
 @auth_router.post("/login/", response_model=Token)
 async def login(user_credentials: UserLogin, session: Session = Depends(get_session)):
-    user = authenticate_user(
+    user = await authenticate_user(
         session, user_credentials.username, user_credentials.password
     )
     if not user:
@@ -68,7 +68,9 @@ async def login(user_credentials: UserLogin, session: Session = Depends(get_sess
             status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user"
         )
 
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_access_token(
+        data={"sub": user.username, "user_id": user.id}
+    )
     return Token(access_token=access_token, token_type="bearer")
 
 
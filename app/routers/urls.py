@@ -1,9 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import RedirectResponse
+import json
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlmodel import Session
 
-from app.models import URLCreate, User
-from app.auth import get_current_active_user
+from app.analytics import analytics_service
+from app.analytics_export import EXPORT_FORMATS, pa, stream_export
+from app.heavy_hitters import heavy_hitters
+from app.config import settings
+from app.models import (
+    HeavyHitter,
+    HeavyHittersResponse,
+    URLAnalyticsResponse,
+    URLBulkCreateResponse,
+    URLBulkItemResult,
+    URLCreate,
+    URLListResponse,
+    URLSearchResponse,
+    URLStatus,
+)
+from app.auth import get_current_active_user, get_current_admin_user
+from app.auth_cache import Principal
 from app.database import get_session
 from app.url_service import url_service
 
@@ -13,24 +34,12 @@ urls_router = APIRouter(prefix="/urls", tags=["urls"])
 @urls_router.post("/")
 def create_short_url(
     url_data: URLCreate,
-    current_user: User = Depends(get_current_active_user),
+    current_user: Principal = Depends(get_current_active_user),
     session: Session = Depends(get_session),
 ):
     try:
         short_url = url_service.create_short_url(session, url_data, current_user.id)
-        return URLResponse(
-            id=short_url.id,
-            short_code=short_url.short_code,
-            short_url=f"{url_service.base_url}/{short_url.short_code}",
-            original_url=short_url.original_url,
-            title=short_url.title,
-            description=short_url.description,
-            is_active=short_url.is_active,
-            created_at=short_url.created_at,
-            expires_at=short_url.expires_at,
-            visit_count=short_url.visit_count,
-            last_visited=short_url.last_visited,
-        )
+        return url_service.to_response(short_url)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -38,20 +47,88 @@ def create_short_url(
         )
 
 
-# @urls_router.get("/")
-# async def get_user_urls(
-#     skip: int = 0,
-#     limit: int = 100,
-#     current_user: User = Depends(get_current_active_user),
-#     session: Session = Depends(get_session),
-# ):
-#     urls = url_service.get_user_urls(session, current_user.id, skip, limit)
+@urls_router.post("/bulk/", response_model=URLBulkCreateResponse)
+async def create_short_urls_bulk(
+    request: Request,
+    current_user: Principal = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
+):
+    """Accepts a JSON array of URLCreate items or an NDJSON body (one item per line)"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    parse_errors = {}
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                # keep a placeholder so the error is reported at the line's index
+                parse_errors[len(items)] = f"Invalid JSON: {e}"
+                items.append(None)
+    else:
+        try:
+            items = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON: {e}"
+            )
+        if not isinstance(items, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected a JSON array of URLs",
+            )
+
+    if len(items) > settings.bulk_create_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.bulk_create_max_items} URLs per request",
+        )
+
+    results = await run_in_threadpool(
+        url_service.create_short_urls_bulk, session, items, current_user.id
+    )
+    for index, error in parse_errors.items():
+        results[index] = URLBulkItemResult(index=index, success=False, error=error)
+    created = sum(1 for result in results if result.success)
+    return URLBulkCreateResponse(
+        created=created, failed=len(results) - created, results=results
+    )
+
+
+@urls_router.get("/", response_model=URLListResponse)
+def get_user_urls(
+    cursor: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=100),
+    status_filter: URLStatus = Query(default=URLStatus.ALL, alias="status"),
+    current_user: Principal = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
+):
+    try:
+        return url_service.list_user_urls(
+            session, current_user.id, status_filter, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@urls_router.get("/search/", response_model=URLSearchResponse)
+def search_user_urls(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    current_user: Principal = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
+):
+    return url_service.search_user_urls(session, current_user.id, q, limit, offset)
 
 
-@urls_router.delete(f"/{url_id}/")
-async def deactivate_url(
+@urls_router.delete("/{url_id}/")
+def deactivate_url(
     url_id: int,
-    current_user: User = Depends(get_session),
+    current_user: Principal = Depends(get_current_active_user),
     session: Session = Depends(get_session),
 ):
     success = url_service.deactivate_url(session, url_id, current_user.id)
@@ -64,21 +141,149 @@ async def deactivate_url(
     return {"message": "URL deactivated successfully"}
 
 
-@router.get("/redirect/{short_code}")
-async def redirect_url(
-    short_code: str, request: Request, session: Session = Depends(get_session)
+@urls_router.get("/{url_id}/analytics/", response_model=URLAnalyticsResponse)
+def get_url_analytics(
+    url_id: int,
+    current_user: Principal = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
+):
+    url = url_service.get_user_url(session, url_id, current_user.id)
+
+    if not url:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
+        )
+
+    return analytics_service.get_url_analytics(session, url)
+
+
+def export_response(
+    export_format: str,
+    filename: str,
+    url_id: Optional[int],
+    owner_id: int,
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> StreamingResponse:
+    if pa is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Analytics export is not available",
+        )
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown format, expected one of {list(EXPORT_FORMATS)}",
+        )
+    media_type, extension = EXPORT_FORMATS[export_format]
+    return StreamingResponse(
+        stream_export(export_format, url_id=url_id, owner_id=owner_id, start=start, end=end),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{extension}"'
+        },
+    )
+
+
+@urls_router.get("/analytics/export/")
+def export_user_analytics(
+    format: str = "parquet",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_active_user),
+):
+    return export_response(
+        format, f"clicks-user-{current_user.id}", None, current_user.id, start, end
+    )
+
+
+@urls_router.get("/{url_id}/analytics/export/")
+def export_url_analytics(
+    url_id: int,
+    format: str = "parquet",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: Principal = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
+):
+    if not url_service.get_user_url(session, url_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
+        )
+    return export_response(
+        format, f"clicks-url-{url_id}", url_id, current_user.id, start, end
+    )
+
+
+@urls_router.get("/hot/", response_model=HeavyHittersResponse)
+async def get_hot_urls(
+    window: str = "5m",
+    limit: int = Query(default=20, ge=1, le=100),
+    current_user: Principal = Depends(get_current_admin_user),
+):
+    """Hottest short codes seen by the worker serving this request over a decayed window.
+
+    Counts are per worker and are not merged across processes; with several
+    workers each one only reports the redirects it handled itself.
+    """
+    if window not in settings.heavy_hitters_windows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown window, expected one of {list(settings.heavy_hitters_windows)}",
+        )
+    return HeavyHittersResponse(
+        worker_pid=os.getpid(),
+        items=[
+            HeavyHitter(value=short_code, score=score)
+            for short_code, score in heavy_hitters.top_codes(window, limit)
+        ],
+    )
+
+
+@urls_router.get("/{url_id}/top-referers/", response_model=HeavyHittersResponse)
+def get_top_referers(
+    url_id: int,
+    window: str = "1h",
+    limit: int = Query(default=10, ge=1, le=100),
+    current_user: Principal = Depends(get_current_active_user),
+    session: Session = Depends(get_session),
 ):
+    """Top referers of a url seen by the worker serving this request.
+
+    Like /urls/hot/, counts are per worker and not merged across processes.
+    """
+    if window not in settings.heavy_hitters_windows:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown window, expected one of {list(settings.heavy_hitters_windows)}",
+        )
+    if not url_service.get_user_url(session, url_id, current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="URL not found"
+        )
+    return HeavyHittersResponse(
+        worker_pid=os.getpid(),
+        items=[
+            HeavyHitter(value=referer, score=score)
+            for referer, score in heavy_hitters.top_referers(url_id, window, limit)
+        ],
+    )
+
+
+@urls_router.get("/redirect/{short_code}")
+async def redirect_url(short_code: str, request: Request):
 
-    url = url_service.get_url_by_code(session, short_code)
+    url = await url_service.async_get_url_by_code(short_code)
 
     if not url:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Short URL not found"
         )
 
-    if url.expires_at and url.expires_at < url.created_at.replace(tzinfo=None):
+    if not url.is_active or url_service.is_expired(url):
         raise HTTPException(
-            status_code=status.HTTP_410_GONE, detail="Short URL has expired"
+            status_code=status.HTTP_410_GONE,
+            detail="Short URL has expired or was deactivated",
         )
 
     client_ip = request.client.host
@@ -86,7 +291,7 @@ async def redirect_url(
     referer = request.headers.get("referer")
 
     url_service.increment_visit_count(
-        session, url, ip_address=client_ip, user_agent=user_agent, referer=referer
+        url, ip_address=client_ip, user_agent=user_agent, referer=referer
     )
 
     return RedirectResponse(url=url.original_url, status_code=302)
@@ -0,0 +1,141 @@
+"""Full text search over a user's urls.
+
+SQLite keeps an external FTS5 table (shorturl_fts, rowid = shorturl.id)
+that URLService updates in the same transaction as the url rows. Postgres
+uses a generated tsvector column with a GIN index plus a trigram index on
+original_url, which the database keeps current by itself.
+"""
+
+import re
+from typing import List, Tuple
+
+from sqlalchemy import Connection, text
+
+from app.models import ShortURL
+
+FTS_TABLE = "shorturl_fts"
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def is_sqlite(connection: Connection) -> bool:
+    return connection.dialect.name == "sqlite"
+
+
+def fts5_query(owner_id: int, query: str) -> str:
+    # every word becomes a quoted prefix term so user input is never parsed
+    # as FTS5 syntax; owner_id is an indexed column to keep the match per user
+    terms = " ".join(f'"{token}"*' for token in TOKEN.findall(query))
+    return f'owner_id : "u{owner_id}" AND ({terms})'
+
+
+class SearchIndex:
+    def setup(self, connection: Connection):
+        if is_sqlite(connection):
+            connection.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    "title, description, original_url, owner_id, "
+                    "tokenize = 'unicode61 remove_diacritics 2')"
+                )
+            )
+            connection.execute(
+                text(
+                    f"INSERT INTO {FTS_TABLE} "
+                    "(rowid, title, description, original_url, owner_id) "
+                    "SELECT id, title, description, original_url, 'u' || owner_id "
+                    "FROM shorturl WHERE is_active = 1 "
+                    f"AND id NOT IN (SELECT rowid FROM {FTS_TABLE})"
+                )
+            )
+            return
+
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(
+            text(
+                "ALTER TABLE shorturl ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                "GENERATED ALWAYS AS ("
+                "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+                "setweight(to_tsvector('simple', coalesce(description, '')), 'B') || "
+                "setweight(to_tsvector('simple', original_url), 'C')) STORED"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_shorturl_search_vector "
+                "ON shorturl USING GIN (search_vector)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_shorturl_original_url_trgm "
+                "ON shorturl USING GIN (original_url gin_trgm_ops)"
+            )
+        )
+
+    def index_urls(self, connection: Connection, urls: List[ShortURL]):
+        if not urls or not is_sqlite(connection):
+            return
+        connection.execute(
+            text(
+                f"INSERT OR REPLACE INTO {FTS_TABLE} "
+                "(rowid, title, description, original_url, owner_id) "
+                "VALUES (:id, :title, :description, :original_url, :owner)"
+            ),
+            [
+                {
+                    "id": url.id,
+                    "title": url.title,
+                    "description": url.description,
+                    "original_url": url.original_url,
+                    "owner": f"u{url.owner_id}",
+                }
+                for url in urls
+            ],
+        )
+
+    def remove_urls(self, connection: Connection, url_ids: List[int]):
+        if not url_ids or not is_sqlite(connection):
+            return
+        connection.execute(
+            text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"),
+            [{"id": url_id} for url_id in url_ids],
+        )
+
+    def search(
+        self,
+        connection: Connection,
+        owner_id: int,
+        query: str,
+        limit: int,
+        offset: int,
+    ) -> List[Tuple[int, float]]:
+        """(url id, relevance) pairs, best match first"""
+        if is_sqlite(connection):
+            if not TOKEN.search(query):
+                return []
+            # bm25 is lower for better matches; weight title over description over url
+            rows = connection.execute(
+                text(
+                    f"SELECT rowid, -bm25({FTS_TABLE}, 10.0, 5.0, 1.0, 0.0) AS rank "
+                    f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match "
+                    "ORDER BY rank DESC LIMIT :limit OFFSET :offset"
+                ),
+                {"match": fts5_query(owner_id, query), "limit": limit, "offset": offset},
+            )
+            return [(row[0], row[1]) for row in rows]
+
+        rows = connection.execute(
+            text(
+                "SELECT id, ts_rank(search_vector, query) "
+                "+ similarity(original_url, :raw) AS rank "
+                "FROM shorturl, websearch_to_tsquery('simple', :raw) AS query "
+                "WHERE owner_id = :owner_id AND is_active "
+                "AND (search_vector @@ query OR original_url % :raw) "
+                "ORDER BY rank DESC LIMIT :limit OFFSET :offset"
+            ),
+            {"raw": query, "owner_id": owner_id, "limit": limit, "offset": offset},
+        )
+        return [(row[0], row[1]) for row in rows]
+
+
+search_index = SearchIndex()
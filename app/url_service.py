@@ -1,52 +1,186 @@
-import string
-import random
+import hashlib
+import time
+from collections import Counter
+from sqlalchemy import and_, bindparam, func, insert, or_, true, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from typing import Any, List, Optional, Tuple, Union
 
+from pydantic import ValidationError
+
+from app.analytics import DIRECT_REFERER, analytics_service
+from app.analytics_partitions import analytics_partitions
+from app.bloom_filter import short_code_filter
+from app.code_allocator import code_allocator
 from app.config import settings
-from app.models import ShortURL, URLCreate, URLAnalytics
-from app.redis_client import redis_service
-from app.utils import get_url_cache_key
+from app.database import async_engine, async_read_engine, engine
+from app.events import event_publisher
+from app.heavy_hitters import heavy_hitters
+from app.models import (
+    ShortURL,
+    URLBulkItemResult,
+    URLCreate,
+    URLListItem,
+    URLListResponse,
+    URLResponse,
+    URLSearchItem,
+    URLSearchResponse,
+    URLStatus,
+)
+from app.local_cache import url_local_cache
+from app.redirect_cache import (
+    GONE,
+    MISSING,
+    RedirectEntry,
+    acquire_lock,
+    decode_entry,
+    encode_entry,
+    needs_refresh,
+    redirect_flights,
+    release_lock,
+    set_active_entry,
+    wait_for_cache,
+)
+from app.redis_client import async_redis_service, redis_service
+from app.search import search_index
+from app.utils import (
+    as_utc,
+    decode_cursor,
+    encode_cursor,
+    get_url_cache_key,
+    get_url_counts_key,
+    get_url_dedup_key,
+    normalize_url,
+)
+from app.visit_buffer import VisitEvent
+from app.write_behind import WriteBehindBuffer
 
 
 class URLService:
     def __init__(self):
         self.base_url = settings.base_url
 
-    def generate_short_code(self, length: int = 6):
-        characters = string.ascii_letters + string.digits
-        return "".join(random.choice(characters) for _ in range(length))
+    # codes are unique by construction, retries only cover an allocator whose
+    # sequence was reset (e.g. a flushed redis counter)
+    max_allocation_attempts = 3
+
+    def generate_short_code(self) -> str:
+        return code_allocator.allocate()
+
+    def get_url_hash(self, url_data: URLCreate, user_id: int) -> str:
+        key = f"{user_id}\n{normalize_url(url_data.original_url)}"
+        if settings.url_dedup_match_title:
+            key += f"\n{url_data.title or ''}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def find_duplicate(self, session: Session, url_hash: str) -> Optional[ShortURL]:
+        """Active, unexpired url with the same dedup hash, from redis or one indexed query"""
+        now = datetime.now(timezone.utc)
+        dedup_key = get_url_dedup_key(url_hash)
+        cached_url = redis_service.get_cache(dedup_key)
+        if cached_url and (
+            not cached_url["expires_at"]
+            or as_utc(datetime.fromisoformat(cached_url["expires_at"])) > now
+        ):
+            return ShortURL(**cached_url)
+
+        statement = (
+            select(ShortURL)
+            .where(
+                ShortURL.url_hash == url_hash,
+                ShortURL.is_active == true(),
+                or_(ShortURL.expires_at.is_(None), ShortURL.expires_at > now),
+            )
+            .order_by(ShortURL.created_at.desc())
+        )
+        url = session.exec(statement).first()
+        if url:
+            redis_service.set_cache(
+                dedup_key,
+                self._serialize_url(url),
+                expire=settings.default_cache_expiry_seconds,
+            )
+        return url
+
+    def find_duplicates(self, session: Session, url_hashes: set) -> dict:
+        """Newest active, unexpired url per dedup hash, in one query"""
+        if not url_hashes:
+            return {}
+        now = datetime.now(timezone.utc)
+        statement = (
+            select(ShortURL)
+            .where(
+                ShortURL.url_hash.in_(url_hashes),
+                ShortURL.is_active == true(),
+                or_(ShortURL.expires_at.is_(None), ShortURL.expires_at > now),
+            )
+            .order_by(ShortURL.created_at.desc())
+        )
+        duplicates = {}
+        for url in session.exec(statement):
+            duplicates.setdefault(url.url_hash, url)
+        return duplicates
 
     def create_short_url(
         self, session: Session, url_data: URLCreate, user_id: int
     ) -> ShortURL:
-        while True:
-            short_code = self.generate_short_code()
-            existing = session.exec(
-                select(ShortURL).where(ShortURL.short_code == short_code)
-            ).first()
-            if not existing:
-                break
+        url_hash = self.get_url_hash(url_data, user_id)
+        dedupe = (
+            settings.url_dedup_enabled if url_data.dedupe is None else url_data.dedupe
+        )
+        if dedupe:
+            existing = self.find_duplicate(session, url_hash)
+            if existing:
+                return existing
 
         expires_at = datetime.now(timezone.utc) + timedelta(
             url_data.expires_in_days or settings.url_default_expiry_days
         )
 
-        short_url = ShortURL(
-            short_code=short_code,
-            original_url=url_data.original_url,
-            title=url_data.title,
-            description=url_data.description,
-            expires_at=expires_at,
-            owner_id=user_id,
-        )
-
-        session.add(short_url)
+        for attempt in range(self.max_allocation_attempts):
+            short_code = self.generate_short_code()
+            short_url = ShortURL(
+                short_code=short_code,
+                original_url=url_data.original_url,
+                title=url_data.title,
+                description=url_data.description,
+                expires_at=expires_at,
+                url_hash=url_hash,
+                owner_id=user_id,
+            )
+            session.add(short_url)
+            try:
+                session.flush()
+                break
+            except IntegrityError:
+                session.rollback()
+                if attempt == self.max_allocation_attempts - 1:
+                    raise
+        search_index.index_urls(session.connection(), [short_url])
         session.commit()
         session.refresh(short_url)
+        if settings.bloom_filter_enabled:
+            short_code_filter.add(short_code)
+        with redis_service.batch() as batch:
+            batch.increment_counters(
+                get_url_counts_key(user_id), {"total": 1, "active": 1}
+            )
+            # replaces any negative cache entry left by a lookup of this code
+            batch.set_cache(
+                get_url_cache_key(short_code),
+                encode_entry(short_url),
+                expire=self.url_cache_ttl,
+            )
+            if dedupe:
+                batch.set_cache(
+                    get_url_dedup_key(url_hash),
+                    self._serialize_url(short_url),
+                    expire=settings.default_cache_expiry_seconds,
+                )
 
-        redis_service.publish_message(
+        event_publisher.publish(
             "url_created",
             {
                 "url_id": short_url.id,
@@ -59,103 +193,653 @@ class URLService:
 
         return short_url
 
-    def get_url_by_code(self, session: Session, short_code: str) -> Optional[ShortURL]:
-        cache_key = get_url_cache_key(short_code)
-        cached_url = redis_service.get_cache(cache_key)
+    def create_short_urls_bulk(
+        self, session: Session, items: List[Any], user_id: int
+    ) -> List[URLBulkItemResult]:
+        """Validate and create many urls, one multi-row insert and one url_created event per chunk"""
+        results: List[Optional[URLBulkItemResult]] = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            try:
+                valid.append((index, URLCreate.model_validate(item)))
+            except ValidationError as e:
+                results[index] = URLBulkItemResult(
+                    index=index, success=False, error=str(e)
+                )
 
-        if cached_url:
-            return ShortURL(**cached_url)
+        chunk_size = settings.bulk_create_chunk_size
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start : start + chunk_size]
+            try:
+                short_urls = self._insert_chunk(session, chunk, user_id)
+            except Exception as e:
+                session.rollback()
+                for index, _ in chunk:
+                    results[index] = URLBulkItemResult(
+                        index=index, success=False, error=f"Failed to create short URL: {e}"
+                    )
+                continue
+            for (index, _), short_url in zip(chunk, short_urls):
+                results[index] = URLBulkItemResult(
+                    index=index, success=True, url=self.to_response(short_url)
+                )
 
-        statement = select(ShortURL).where(
-            ShortURL.short_code == short_code, ShortURL.is_active == True
+        return results
+
+    def _insert_chunk(
+        self, session: Session, chunk: List[tuple], user_id: int
+    ) -> List[ShortURL]:
+        """Create the urls of a chunk, reusing existing links for items that dedupe"""
+        now = datetime.now(timezone.utc)
+        url_hashes = [self.get_url_hash(url_data, user_id) for _, url_data in chunk]
+        dedupes = [
+            settings.url_dedup_enabled if url_data.dedupe is None else url_data.dedupe
+            for _, url_data in chunk
+        ]
+        existing = self.find_duplicates(
+            session, {url_hash for url_hash, dedupe in zip(url_hashes, dedupes) if dedupe}
         )
-        url = session.exec(statement).first()
 
-        if url:
-            url_dict = {
-                "id": url.id,
-                "short_code": url.short_code,
-                "original_url": url.original_url,
-                "title": url.title,
-                "description": url.description,
-                "is_active": url.is_active,
-                "created_at": url.created_at.isoformat(),
-                "expires_at": url.expires_at.isoformat() if url.expires_at else None,
-                "visit_count": url.visit_count,
-                "last_visited": (
-                    url.last_visited.isoformat() if url.last_visited else None
+        results: List[Optional[ShortURL]] = [None] * len(chunk)
+        new_positions = []
+        # same destination twice in one chunk reuses the first new row
+        first_new = {}
+        aliases = []
+        for position, url_hash in enumerate(url_hashes):
+            if dedupes[position] and url_hash in existing:
+                results[position] = existing[url_hash]
+            elif dedupes[position] and url_hash in first_new:
+                aliases.append((position, first_new[url_hash]))
+            else:
+                first_new.setdefault(url_hash, position)
+                new_positions.append(position)
+        if not new_positions:
+            for position, target in aliases:
+                results[position] = results[target]
+            return results
+
+        codes = code_allocator.allocate_many(len(new_positions))
+        rows = [
+            {
+                "short_code": short_code,
+                "original_url": chunk[position][1].original_url,
+                "title": chunk[position][1].title,
+                "description": chunk[position][1].description,
+                "is_active": True,
+                "created_at": now,
+                "expires_at": now
+                + timedelta(
+                    chunk[position][1].expires_in_days
+                    or settings.url_default_expiry_days
                 ),
-                "owner_id": url.owner_id,
+                "visit_count": 0,
+                "url_hash": url_hashes[position],
+                "owner_id": user_id,
             }
-            redis_service.set_cache(
-                cache_key, url_dict, expire=settings.default_cache_expiry_seconds
+            for short_code, position in zip(codes, new_positions)
+        ]
+
+        table = ShortURL.__table__
+        ids = session.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        short_urls = [ShortURL(id=url_id, **row) for url_id, row in zip(ids, rows)]
+        search_index.index_urls(session.connection(), short_urls)
+        session.commit()
+        if settings.bloom_filter_enabled:
+            short_code_filter.add_many(codes)
+
+        with redis_service.batch() as batch:
+            for position, short_url in zip(new_positions, short_urls):
+                results[position] = short_url
+                batch.set_cache(
+                    get_url_cache_key(short_url.short_code),
+                    encode_entry(short_url),
+                    expire=self.url_cache_ttl,
+                )
+                if dedupes[position]:
+                    batch.set_cache(
+                        get_url_dedup_key(short_url.url_hash),
+                        self._serialize_url(short_url),
+                        expire=settings.default_cache_expiry_seconds,
+                    )
+            batch.increment_counters(
+                get_url_counts_key(user_id),
+                {"total": len(short_urls), "active": len(short_urls)},
             )
+        for position, target in aliases:
+            results[position] = results[target]
+        event_publisher.publish(
+            "url_created",
+            {
+                "user_id": user_id,
+                "urls": [
+                    {
+                        "url_id": short_url.id,
+                        "short_code": short_url.short_code,
+                        "original_url": short_url.original_url,
+                        "created_at": short_url.created_at.isoformat(),
+                    }
+                    for short_url in short_urls
+                ],
+            },
+        )
+        return results
 
-        return url
+    def to_response(self, short_url: ShortURL) -> URLResponse:
+        return URLResponse(
+            id=short_url.id,
+            short_code=short_url.short_code,
+            short_url=f"{self.base_url}/{short_url.short_code}",
+            original_url=short_url.original_url,
+            title=short_url.title,
+            description=short_url.description,
+            is_active=short_url.is_active,
+            created_at=short_url.created_at,
+            expires_at=short_url.expires_at,
+            visit_count=short_url.visit_count,
+            last_visited=short_url.last_visited,
+        )
+
+    @property
+    def url_cache_ttl(self) -> int:
+        # redis keeps entries past their soft expiry so they can be served stale
+        return settings.default_cache_expiry_seconds + settings.cache_stale_seconds
+
+    async def async_get_url_by_code(self, short_code: str) -> Optional[RedirectEntry]:
+        cache_key = get_url_cache_key(short_code)
+        entry = url_local_cache.get(cache_key)
+        if entry:
+            return entry
+
+        cached = await async_redis_service.get_string(cache_key)
+        entry = decode_entry(short_code, cached)
+        if entry:
+            if needs_refresh(entry):
+                # serve what we have, one task per worker refreshes it behind us
+                redirect_flights.spawn(
+                    cache_key, lambda: self._refresh_url_cache(short_code)
+                )
+            url_local_cache.set(cache_key, entry)
+            return entry
+        if cached == MISSING:
+            return None
+
+        if (
+            settings.bloom_filter_enabled
+            and await short_code_filter.might_contain(short_code) is False
+        ):
+            return None
+
+        cached, cacheable = await redirect_flights.do(
+            cache_key, lambda: self._fill_url_cache(short_code)
+        )
+        if not cacheable:
+            return decode_entry(short_code, cached)
+        return self._from_cache(cache_key, short_code, cached)
+
+    async def _fill_url_cache(self, short_code: str) -> Tuple[str, bool]:
+        cache_key = get_url_cache_key(short_code)
+        token = await acquire_lock(cache_key)
+        if token is None:
+            # another worker is loading this code, give it a moment first
+            cached = await wait_for_cache(cache_key)
+            if cached:
+                return cached, True
+            return await self._load_url_entry(short_code)
+        try:
+            return await self._load_url_entry(short_code)
+        finally:
+            await release_lock(cache_key, token)
+
+    async def _refresh_url_cache(self, short_code: str):
+        cache_key = get_url_cache_key(short_code)
+        token = await acquire_lock(cache_key)
+        if token is None:
+            return
+        try:
+            cached, cacheable = await self._load_url_entry(short_code)
+            url_local_cache.delete(cache_key)
+            if cacheable:
+                self._from_cache(cache_key, short_code, cached)
+        except Exception as e:
+            # the stale entry keeps being served until the next attempt
+            pass
+        finally:
+            await release_lock(cache_key, token)
+
+    async def _load_url_entry(self, short_code: str) -> Tuple[str, bool]:
+        """Read a code from the database and write its packed entry to redis.
+
+        Returns the entry and whether it may go in this worker's local cache,
+        which it may not when redis could not confirm there is no tombstone.
+        """
+        cache_key = get_url_cache_key(short_code)
+        cached = await self._read_url_entry(async_read_engine, short_code)
+        if cached == MISSING and async_read_engine is not async_engine:
+            # a code created moments ago may not have reached the replica yet
+            cached = await self._read_url_entry(async_engine, short_code)
+        if cached in (GONE, MISSING):
+            await async_redis_service.set_cache(
+                cache_key, cached, expire=settings.negative_cache_seconds
+            )
+        else:
+            stored = await set_active_entry(cache_key, cached, self.url_cache_ttl)
+            if stored is None:
+                # redis is down or slow, serve the row but treat it as a miss
+                return cached, False
+            if not stored:
+                # deactivated since the row was read, the tombstone wins
+                return GONE, True
+        return cached, True
+
+    async def _read_url_entry(self, read_engine, short_code: str) -> str:
+        started = time.monotonic()
+        async with AsyncSession(read_engine, expire_on_commit=False) as session:
+            statement = select(ShortURL).where(
+                ShortURL.short_code == short_code, ShortURL.is_active == true()
+            )
+            url = (await session.exec(statement)).first()
+            if url:
+                return encode_entry(url, time.monotonic() - started)
+
+            gone = (
+                await session.exec(
+                    select(ShortURL.id).where(ShortURL.short_code == short_code)
+                )
+            ).first()
+        return GONE if gone is not None else MISSING
+
+    def _from_cache(
+        self, cache_key: str, short_code: str, cached: str
+    ) -> Optional[RedirectEntry]:
+        # unknown codes are only cached in redis, so a newly created code is
+        # never hidden by a stale entry in some worker's local cache
+        entry = decode_entry(short_code, cached)
+        if entry:
+            url_local_cache.set(cache_key, entry)
+        return entry
+
+    def is_expired(self, url: Union[ShortURL, RedirectEntry]) -> bool:
+        expires_at = url.expires_at
+        if not expires_at:
+            return False
+        return as_utc(expires_at) <= datetime.now(timezone.utc)
+
+    async def prewarm_local_cache(self):
+        """Refresh this worker's hottest codes in the local cache before they expire"""
+        window = next(iter(settings.heavy_hitters_windows))
+        hot_codes = heavy_hitters.top_codes(window, settings.hot_urls_prewarm_count)
+        if not hot_codes:
+            return
+        short_codes = [short_code for short_code, _ in hot_codes]
+        cache_keys = [get_url_cache_key(short_code) for short_code in short_codes]
+        cached = await async_redis_service.get_strings(cache_keys)
+        for cache_key, short_code, value in zip(cache_keys, short_codes, cached):
+            self._from_cache(cache_key, short_code, value)
+
+    def _serialize_url(self, url: ShortURL) -> dict:
+        return {
+            "id": url.id,
+            "short_code": url.short_code,
+            "original_url": url.original_url,
+            "title": url.title,
+            "description": url.description,
+            "is_active": url.is_active,
+            "created_at": url.created_at.isoformat(),
+            "expires_at": url.expires_at.isoformat() if url.expires_at else None,
+            "visit_count": url.visit_count,
+            "last_visited": (
+                url.last_visited.isoformat() if url.last_visited else None
+            ),
+            "owner_id": url.owner_id,
+        }
 
     def increment_visit_count(
         self,
-        session: Session,
-        url: ShortURL,
+        url: Union[ShortURL, RedirectEntry],
         ip_address: str,
         user_agent: str = None,
         referer: str = None,
-    ) -> ShortURL:
-        """Increment visit count and publish redis events for expiry and visit threshold"""
-        url.visit_count += 1
-        url.last_visited = datetime.now(timezone.utc)
-        session.add(url)
-        session.commit()
-
-        analytics = URLAnalytics(
-            url_id=url.id, ip_address=ip_address, user_agent=user_agent, referer=referer
+    ) -> Union[ShortURL, RedirectEntry]:
+        """Queue a visit for the write-behind buffer, the database is updated on flush"""
+        heavy_hitters.record(url.id, url.short_code, referer or DIRECT_REFERER)
+        visit_buffer.add(
+            VisitEvent(
+                url_id=url.id,
+                owner_id=url.owner_id,
+                visited_at=datetime.now(timezone.utc),
+                ip_address=ip_address,
+                user_agent=user_agent,
+                referer=referer,
+            )
         )
-        session.add(analytics)
-        session.commit()
+        return url
+
+    def flush_visits(self, events: List[VisitEvent]):
+        """Apply a batch of buffered visits and publish stream events for expiry and visit threshold"""
+        counts = Counter(event.url_id for event in events)
+        # events are buffered in arrival order, so the last one per url wins
+        last_visited = {event.url_id: event.visited_at for event in events}
 
-        if url.visit_count == settings.visit_threshold:
-            redis_service.publish_message(
-                "visit_threshold_reached",
-                {
-                    "url_id": url.id,
-                    "short_code": url.short_code,
-                    "visit_count": url.visit_count,
-                    "user_id": url.owner_id,
-                },
-            )
-
-        if url.expires_at:
-            days_until_expiry = (url.expires_at - datetime.now(timezone.utc)).days
-            if days_until_expiry <= settings.expiration_warning_days:
-                redis_service.publish_message(
-                    "url_expiring_soon",
+        shorturl = ShortURL.__table__
+        with Session(engine) as session:
+            session.execute(
+                update(shorturl)
+                .where(shorturl.c.id == bindparam("b_id"))
+                .values(
+                    visit_count=shorturl.c.visit_count + bindparam("b_count"),
+                    last_visited=bindparam("b_last_visited"),
+                ),
+                [
+                    {
+                        "b_id": url_id,
+                        "b_count": count,
+                        "b_last_visited": last_visited[url_id],
+                    }
+                    for url_id, count in counts.items()
+                ],
+            )
+            analytics_partitions.insert_rows(
+                session.connection(),
+                [
+                    {
+                        "url_id": event.url_id,
+                        "user_id": event.owner_id,
+                        "visited_at": event.visited_at,
+                        "ip_address": event.ip_address,
+                        "user_agent": event.user_agent,
+                        "referer": event.referer,
+                    }
+                    for event in events
+                ],
+            )
+            analytics_service.record_visits(session, events)
+            session.commit()
+
+            urls = session.exec(
+                select(ShortURL).where(ShortURL.id.in_(counts.keys()))
+            ).all()
+
+        analytics_service.record_unique_visitors(events)
+        if settings.event_stream_visits:
+            for event in events:
+                event_publisher.publish(
+                    "url_visited",
+                    {
+                        "url_id": event.url_id,
+                        "user_id": event.owner_id,
+                        "visited_at": event.visited_at.isoformat(),
+                        "referer": event.referer,
+                    },
+                )
+
+        now = datetime.now(timezone.utc)
+        for url in urls:
+            previous_count = url.visit_count - counts[url.id]
+            if previous_count < settings.visit_threshold <= url.visit_count:
+                event_publisher.publish(
+                    "visit_threshold_reached",
                     {
                         "url_id": url.id,
                         "short_code": url.short_code,
-                        "expires_at": url.expires_at.isoformat(),
-                        "days_until_expiry": days_until_expiry,
+                        "visit_count": url.visit_count,
                         "user_id": url.owner_id,
                     },
                 )
 
-        return url
+            if url.expires_at:
+                days_until_expiry = (as_utc(url.expires_at) - now).days
+                if days_until_expiry <= settings.expiration_warning_days:
+                    event_publisher.publish(
+                        "url_expiring_soon",
+                        {
+                            "url_id": url.id,
+                            "short_code": url.short_code,
+                            "expires_at": url.expires_at.isoformat(),
+                            "days_until_expiry": days_until_expiry,
+                            "user_id": url.owner_id,
+                        },
+                    )
 
-    def deactivate_url(self, session: Session, url_id: int, user_id: int) -> bool:
+    def get_url_visits(
+        self,
+        session: Session,
+        url_id: int,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = 100,
+    ) -> List[dict]:
+        """Raw visits of a url, read only from the partitions covering [start, end)"""
+        statement = analytics_partitions.select_visits(
+            session.connection(), url_id=url_id, start=start, end=end
+        )
+        if statement is None:
+            return []
+        visits = statement.subquery()
+        rows = session.execute(
+            visits.select().order_by(visits.c.visited_at.desc()).limit(limit)
+        )
+        return [dict(row) for row in rows.mappings()]
+
+    def list_user_urls(
+        self,
+        session: Session,
+        user_id: int,
+        status: URLStatus = URLStatus.ALL,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> URLListResponse:
+        """Newest first keyset page over (owner_id, created_at, id), raises ValueError for a bad cursor"""
+        now = datetime.now(timezone.utc)
+        statement = (
+            self._list_columns()
+            .where(ShortURL.owner_id == user_id)
+            .order_by(ShortURL.created_at.desc(), ShortURL.id.desc())
+            .limit(limit + 1)
+        )
+        if status == URLStatus.ACTIVE:
+            statement = statement.where(
+                ShortURL.is_active == true(),
+                or_(ShortURL.expires_at.is_(None), ShortURL.expires_at > now),
+            )
+        elif status == URLStatus.EXPIRED:
+            statement = statement.where(ShortURL.expires_at <= now)
+        if cursor:
+            created_at, url_id = decode_cursor(cursor)
+            statement = statement.where(
+                or_(
+                    ShortURL.created_at < created_at,
+                    and_(ShortURL.created_at == created_at, ShortURL.id < url_id),
+                )
+            )
+
+        rows = session.exec(statement).all()
+        page = rows[:limit]
+        counts = self.get_url_counts(session, user_id)
+        return URLListResponse(
+            items=[self._list_item(row) for row in page],
+            next_cursor=(
+                encode_cursor(page[-1].created_at, page[-1].id)
+                if len(rows) > limit
+                else None
+            ),
+            total_count=counts["total"],
+            active_count=counts["active"],
+        )
+
+    def search_user_urls(
+        self,
+        session: Session,
+        user_id: int,
+        query: str,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> URLSearchResponse:
+        matches = search_index.search(
+            session.connection(), user_id, query, limit, offset
+        )
+        ranks = dict(matches)
+        rows = session.exec(
+            self._list_columns().where(
+                ShortURL.id.in_(ranks.keys()), ShortURL.owner_id == user_id
+            )
+        ).all()
+        items = [
+            URLSearchItem(**self._list_item(row).model_dump(), rank=ranks[row.id])
+            for row in rows
+        ]
+        items.sort(key=lambda item: item.rank, reverse=True)
+        return URLSearchResponse(items=items, limit=limit, offset=offset)
+
+    def _list_columns(self):
+        return select(
+            ShortURL.id,
+            ShortURL.short_code,
+            ShortURL.original_url,
+            ShortURL.title,
+            ShortURL.is_active,
+            ShortURL.created_at,
+            ShortURL.expires_at,
+            ShortURL.visit_count,
+        )
+
+    def _list_item(self, row) -> URLListItem:
+        return URLListItem(
+            id=row.id,
+            short_code=row.short_code,
+            short_url=f"{self.base_url}/{row.short_code}",
+            original_url=row.original_url,
+            title=row.title,
+            is_active=row.is_active,
+            created_at=row.created_at,
+            expires_at=row.expires_at,
+            visit_count=row.visit_count,
+        )
+
+    def get_url_counts(self, session: Session, user_id: int) -> dict:
+        """Total and active url counts, cached in redis and kept current on create/deactivate"""
+        counts_key = get_url_counts_key(user_id)
+        counts = redis_service.get_counters(counts_key)
+        if "total" in counts and "active" in counts:
+            return counts
+
+        total, active = session.exec(
+            select(
+                func.count(ShortURL.id),
+                func.count(ShortURL.id).filter(ShortURL.is_active == true()),
+            ).where(ShortURL.owner_id == user_id)
+        ).one()
+        counts = {"total": total, "active": active}
+        redis_service.set_counters(
+            counts_key, counts, expire=settings.url_counts_cache_seconds
+        )
+        return counts
+
+    def get_user_url(
+        self, session: Session, url_id: int, user_id: int
+    ) -> Optional[ShortURL]:
         statement = select(ShortURL).where(
             ShortURL.id == url_id, ShortURL.owner_id == user_id
         )
-        url = session.exec(statement).first()
+        return session.exec(statement).first()
+
+    def deactivate_url(self, session: Session, url_id: int, user_id: int) -> bool:
+        url = self.get_user_url(session, url_id, user_id)
 
         if url:
+            was_active = url.is_active
             url.is_active = False
             session.add(url)
+            search_index.remove_urls(session.connection(), [url.id])
             session.commit()
 
-            cache_key = get_url_cache_key(url.short_code)
-            redis_service.delete_cache(cache_key)
+            if was_active:
+                redis_service.increment_counters(
+                    get_url_counts_key(user_id), {"active": -1}
+                )
+            if url.url_hash:
+                redis_service.delete_cache(get_url_dedup_key(url.url_hash))
+            self.invalidate_url_cache(url.short_code)
 
             return True
         return False
 
+    def invalidate_url_cache(self, short_code: str):
+        self.invalidate_url_caches([short_code])
+
+    def invalidate_url_caches(self, short_codes: List[str]):
+        """Replace deactivated codes with gone tombstones and drop them from every local cache"""
+        cache_keys = [get_url_cache_key(short_code) for short_code in short_codes]
+        with redis_service.batch() as batch:
+            for cache_key in cache_keys:
+                # a tombstone instead of a delete, so a lagging read replica
+                # cannot re-cache the url as active
+                batch.set_cache(cache_key, GONE, expire=self.url_cache_ttl)
+            batch.publish_message(
+                settings.cache_invalidation_channel, {"short_codes": short_codes}
+            )
+        for cache_key in cache_keys:
+            url_local_cache.delete(cache_key)
+
+    def handle_cache_invalidation(self, message: dict):
+        for short_code in message.get("short_codes", []):
+            url_local_cache.delete(get_url_cache_key(short_code))
+
+    def deactivate_expired_urls(self) -> int:
+        """Deactivate expired urls in batches and evict them from every cache"""
+        deactivated = 0
+        shorturl = ShortURL.__table__
+        while True:
+            now = datetime.now(timezone.utc)
+            with Session(engine) as session:
+                expired_ids = session.exec(
+                    select(ShortURL.id)
+                    .where(ShortURL.is_active == true(), ShortURL.expires_at <= now)
+                    .order_by(ShortURL.expires_at)
+                    .limit(settings.expiry_sweep_batch_size)
+                ).all()
+                if not expired_ids:
+                    break
+                # every worker sweeps, only rows this update flipped are ours
+                # to count and evict
+                urls = session.execute(
+                    update(shorturl)
+                    .where(shorturl.c.id.in_(expired_ids), shorturl.c.is_active == true())
+                    .values(is_active=False)
+                    .returning(
+                        shorturl.c.id,
+                        shorturl.c.short_code,
+                        shorturl.c.owner_id,
+                        shorturl.c.url_hash,
+                    )
+                ).all()
+                search_index.remove_urls(session.connection(), [url.id for url in urls])
+                session.commit()
+
+            if urls:
+                with redis_service.batch() as batch:
+                    for owner_id, count in Counter(url.owner_id for url in urls).items():
+                        batch.increment_counters(
+                            get_url_counts_key(owner_id), {"active": -count}
+                        )
+                    for url in urls:
+                        if url.url_hash:
+                            batch.delete_cache(get_url_dedup_key(url.url_hash))
+                self.invalidate_url_caches([url.short_code for url in urls])
+            deactivated += len(urls)
+
+            if len(expired_ids) < settings.expiry_sweep_batch_size:
+                break
+        return deactivated
+
 
 url_service = URLService()
+
+# visits are written behind, the redirect only appends to this buffer
+visit_buffer = WriteBehindBuffer(
+    url_service.flush_visits,
+    max_size=settings.visit_buffer_max_size,
+    flush_interval=settings.visit_buffer_flush_interval_seconds,
+    max_pending=settings.visit_buffer_max_pending,
+)
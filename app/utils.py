@@ -1,10 +1,87 @@
+import asyncio
+import base64
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
 from fastapi import Request
 
 
-def get_rate_limit_key(request: Request) -> str:
-    client_ip = request.client.host
-    return f"rate_limit:{client_ip}"
+def get_rate_limit_key(
+    request: Request, user_id: Optional[str] = None, scope: str = "global"
+) -> str:
+    if user_id is not None:
+        identity = f"user:{user_id}"
+    else:
+        identity = f"ip:{request.client.host}"
+    # hash tag keeps every window of one identity on the same cluster slot
+    return f"rate_limit:{{{identity}}}:{scope}"
 
 
 def get_url_cache_key(short_code: str):
     return f"url:{short_code}"
+
+
+def get_unique_visitors_key(url_id: int):
+    return f"analytics:unique:{url_id}"
+
+
+def get_url_dedup_key(url_hash: str):
+    return f"url_dedup:{url_hash}"
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a url for deduplication, not for redirecting.
+
+    Only spellings of the same target are folded together: the case of the
+    scheme and host, a default port and an empty path. Userinfo, query and
+    fragment are kept as given since any change to them can change where
+    the link leads.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    userinfo, at, host = parts.netloc.rpartition("@")
+    host = host.lower()
+    if parts.port is not None and parts.port == DEFAULT_PORTS.get(scheme):
+        host = host.rsplit(":", 1)[0]
+    return urlunsplit(
+        (scheme, f"{userinfo}{at}{host}", parts.path or "/", parts.query, parts.fragment)
+    )
+
+
+def get_url_counts_key(user_id: int):
+    return f"url_counts:{user_id}"
+
+
+def encode_cursor(created_at: datetime, url_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{url_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor, raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, url_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(url_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def as_utc(value: datetime) -> datetime:
+    """Treat naive datetimes read back from the database as UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+async def run_periodically(interval: float, func: Callable[[], Awaitable[None]]):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await func()
+        except Exception as e:
+            pass
@@ -0,0 +1,11 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+
+class VisitEvent(NamedTuple):
+    url_id: int
+    owner_id: int
+    visited_at: datetime
+    ip_address: Optional[str] = None
+    user_agent: Optional[str] = None
+    referer: Optional[str] = None
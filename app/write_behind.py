@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from typing import Any, Callable, List, Optional
+
+
+class WriteBehindBuffer:
+    """Collects items in memory and hands them to `flush_handler` in batches.
+
+    A flush is triggered when `max_size` items are pending or every
+    `flush_interval` seconds, whichever comes first. The handler runs in a
+    worker thread so the event loop never waits on it. `add` is safe to call
+    from any thread. If the handler raises, the batch is put back, keeping at
+    most `max_pending` items (oldest dropped first).
+    """
+
+    def __init__(
+        self,
+        flush_handler: Callable[[List[Any]], None],
+        max_size: int,
+        flush_interval: float,
+        max_pending: int,
+    ):
+        self.flush_handler = flush_handler
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._items: List[Any] = []
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, item: Any):
+        with self._lock:
+            self._items.append(item)
+            pending = len(self._items)
+        if pending >= self.max_size and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _drain(self) -> List[Any]:
+        with self._lock:
+            items, self._items = self._items, []
+        return items
+
+    def _requeue(self, items: List[Any]):
+        with self._lock:
+            self._items = (items + self._items)[-self.max_pending :]
+
+    async def flush(self):
+        items = self._drain()
+        if not items:
+            return
+        try:
+            await asyncio.to_thread(self.flush_handler, items)
+        except Exception as e:
+            self._requeue(items)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+from sqlmodel import SQLModel, create_engine
+
+from app.analytics_export import iter_record_batches
+from app.analytics_partitions import analytics_partitions
+
+
+def test_export_maps_partition_columns_by_name():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    visited_at = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+
+    with engine.begin() as connection:
+        analytics_partitions.insert_rows(
+            connection,
+            [
+                {
+                    "url_id": 1,
+                    "user_id": 2,
+                    "visited_at": visited_at,
+                    "ip_address": "testclient",
+                    "user_agent": "pytest",
+                    "referer": None,
+                }
+            ],
+        )
+        table = pa.Table.from_batches(list(iter_record_batches(connection)))
+
+    assert table.num_rows == 1
+    row = table.to_pylist()[0]
+    assert row["url_id"] == 1
+    assert row["user_id"] == 2
+    assert row["ip_address"] == "testclient"
+    assert row["visited_at"] == visited_at
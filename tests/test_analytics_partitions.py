@@ -0,0 +1,34 @@
+from datetime import date, datetime, timezone
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlmodel import SQLModel, create_engine
+
+from app.analytics_partitions import analytics_partitions as partitions
+from app.models import ShortURL
+
+
+def test_partition_is_created_again_after_a_rolled_back_flush():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    row = {
+        "url_id": 1,
+        "user_id": 2,
+        "visited_at": datetime(2024, 6, 1, 12, tzinfo=timezone.utc),
+        "ip_address": "testclient",
+        "user_agent": "pytest",
+        "referer": None,
+    }
+
+    with pytest.raises(RuntimeError):
+        with engine.begin() as connection:
+            # like the visit flusher, write first so the create is transactional
+            connection.execute(update(ShortURL.__table__).values(visit_count=0))
+            partitions.insert_rows(connection, [row])
+            raise RuntimeError("rollup failed")
+
+    with engine.begin() as connection:
+        connection.execute(update(ShortURL.__table__).values(visit_count=0))
+        partitions.insert_rows(connection, [row])
+        table = partitions.table(partitions.partition_name(date(2024, 6, 1)))
+        assert connection.execute(select(func.count()).select_from(table)).scalar() == 1
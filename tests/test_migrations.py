@@ -0,0 +1,35 @@
+import threading
+
+from sqlalchemy import select
+from sqlmodel import SQLModel, create_engine
+
+from app.migrations import MIGRATIONS, run_migrations
+from app.models import SchemaMigration
+
+
+def test_concurrent_workers_apply_each_migration_once(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    SQLModel.metadata.create_all(create_engine(url))
+    barrier = threading.Barrier(4)
+    applied, errors = [], []
+
+    def start_worker():
+        # waits on the winner's write lock, like busy_timeout does in the app
+        bind = create_engine(url, connect_args={"timeout": 30})
+        barrier.wait()
+        try:
+            applied.extend(migration.version for migration in run_migrations(bind))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=start_worker) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    assert sorted(applied) == [migration.version for migration in MIGRATIONS]
+    with create_engine(url).connect() as connection:
+        versions = connection.execute(select(SchemaMigration.version)).scalars().all()
+    assert sorted(versions) == sorted(applied)
@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app import redirect_cache
+from app.config import settings
+from app.local_cache import url_local_cache
+from app.redirect_cache import (
+    RELEASE_LOCK_SCRIPT,
+    SET_UNLESS_GONE_SCRIPT,
+    encode_entry,
+)
+from app.redis_client import async_redis_service
+from app.url_service import url_service
+from app.utils import get_url_cache_key
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(async_redis_service, "client", client)
+    monkeypatch.setattr(redirect_cache, "async_redis_client", client)
+    monkeypatch.setattr(
+        redirect_cache,
+        "release_lock_script",
+        client.register_script(RELEASE_LOCK_SCRIPT),
+    )
+    monkeypatch.setattr(
+        redirect_cache,
+        "set_unless_gone_script",
+        client.register_script(SET_UNLESS_GONE_SCRIPT),
+    )
+    monkeypatch.setattr(settings, "bloom_filter_enabled", False)
+    return server
+
+
+def test_redirect_survives_redis_outage(redis_server, monkeypatch):
+    url = SimpleNamespace(
+        id=1, owner_id=2, original_url="https://example.com", expires_at=None
+    )
+
+    async def read_url_entry(read_engine, short_code):
+        return encode_entry(url)
+
+    monkeypatch.setattr(url_service, "_read_url_entry", read_url_entry)
+    cache_key = get_url_cache_key("abc1234")
+    url_local_cache.delete(cache_key)
+
+    redis_server.connected = False
+    entry = asyncio.run(url_service.async_get_url_by_code("abc1234"))
+    assert entry.is_active
+    assert entry.original_url == "https://example.com"
+    # not confirmed by redis, so the next request goes back to the database
+    assert url_local_cache.get(cache_key) is None
+
+    redis_server.connected = True
+    entry = asyncio.run(url_service.async_get_url_by_code("abc1234"))
+    assert entry.is_active
+    url_local_cache.delete(cache_key)